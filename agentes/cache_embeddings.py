@@ -0,0 +1,98 @@
+"""
+Caché persistente de embeddings en SQLite
+
+Guarda los vectores calculados por Ollama entre ejecuciones, indexados por
+modelo y hash del texto embebido. Es el segundo nivel de la caché de
+CodeAnalysisAgent (el primero es el LRU en memoria).
+"""
+
+import sqlite3
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Versión del formato de la tabla; al cambiar, la caché existente se descarta
+EMBEDDING_CACHE_VERSION = 2
+# Claves por consulta en batch_get (por debajo del límite de parámetros de SQLite antiguos, 999)
+BATCH_GET_CHUNK = 500
+
+
+class EmbeddingCache:
+    """
+    Embeddings en un archivo SQLite: (modelo, clave) -> vector float16.
+    La mitad de bytes que float32; la precisión (~3 cifras) alcanza para la búsqueda
+    y los vectores ya se recortan a vector_precision cifras antes de ir a Weaviate.
+    """
+
+    def __init__(self, db_path: str, model: str):
+        self.db_path = Path(db_path)
+        self.model = model
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Una sola conexión compartida entre threads, serializada con el lock
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != EMBEDDING_CACHE_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS embeddings")
+            self._conn.execute(f"PRAGMA user_version = {EMBEDDING_CACHE_VERSION}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " key BLOB NOT NULL,"
+            " vec BLOB NOT NULL,"
+            " PRIMARY KEY (model, key)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _encode(embedding: List[float]) -> bytes:
+        return struct.pack(f'<{len(embedding)}e', *embedding)
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        return list(struct.unpack(f'<{len(blob) // 2}e', blob))
+
+    def batch_get(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Embeddings guardados para las claves dadas, en una consulta por bloque (las ausentes no aparecen)"""
+        found = {}
+        try:
+            with self._lock:
+                for i in range(0, len(keys), BATCH_GET_CHUNK):
+                    chunk = keys[i:i + BATCH_GET_CHUNK]
+                    rows = self._conn.execute(
+                        f"SELECT key, vec FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                        (self.model, *chunk)
+                    )
+                    for key, blob in rows:
+                        found[key] = self._decode(blob)
+        except sqlite3.Error as e:
+            print(f"⚠️  Error leyendo la caché de embeddings: {e}")
+        return found
+
+    def put_many(self, items: List[Tuple[bytes, List[float]]]):
+        """Guarda embeddings (los vacíos, de peticiones fallidas, se ignoran)"""
+        rows = []
+        for key, embedding in items:
+            if not embedding:
+                continue
+            try:
+                rows.append((self.model, key, self._encode(embedding)))
+            except (struct.error, OverflowError):
+                continue  # Componentes fuera del rango de float16: no se guarda
+        if not rows:
+            return
+        try:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, key, vec) VALUES (?, ?, ?)", rows
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️  Error guardando en la caché de embeddings: {e}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
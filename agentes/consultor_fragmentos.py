@@ -12,6 +12,7 @@ from .router_ia import ModelRouterAgent, TaskType, ModelProvider
 from datetime import datetime
 from .indexador_fragmentos import CodeAnalysisAgent
 import time
+import math
 import unicodedata
 
 class FragmentQueryAgent:
@@ -21,13 +22,20 @@ class FragmentQueryAgent:
     """
     
     def __init__(self, weaviate_client=None):
-        if weaviate_client is None:
-            from .indexador_fragmentos import CodeAnalysisAgent
-            self.code_agent = CodeAnalysisAgent()
-            self.weaviate_client = self.code_agent.weaviate_client
-        else:
-            self.weaviate_client = weaviate_client
+        # Con un cliente dado, el agente de embeddings lo reutiliza en lugar de abrir otra conexión
+        # (sin tocar su configuración de lotes: solo se configura si se indexa con code_agent)
+        self.code_agent = CodeAnalysisAgent(weaviate_client=weaviate_client)
+        self.weaviate_client = self.code_agent.weaviate_client
         self._esquema_cache = None
+        # Búsquedas semánticas recientes por clase: [(embedding, norma, respuesta_cruda, instante)].
+        # Una pregunta casi idéntica (coseno >= cache_similitud) reutiliza la respuesta de Weaviate
+        self._cache_busquedas = {}
+        self.cache_similitud = 0.95
+        # Corto: una re-indexación desde otro proceso (analizador_codigo.py) no se notifica aquí
+        self.cache_ttl = 300  # segundos
+        self.cache_max_busquedas = 64  # por clase
+        # Las re-indexaciones y borrados hechos con code_agent vacían la caché de esa clase
+        self.code_agent.on_project_data_changed = self.limpiar_cache_busquedas
         self.model_router = ModelRouterAgent()
         self.prompt_generator = PromptGenerator()
 
@@ -36,6 +44,42 @@ class FragmentQueryAgent:
             self._esquema_cache = self.weaviate_client.schema.get()
         return self._esquema_cache
 
+    def _busqueda_en_cache(self, class_name, query_embedding):
+        """Respuesta cruda de una búsqueda reciente casi idéntica a query_embedding (o None)"""
+        entradas = self._cache_busquedas.get(class_name)
+        if not entradas:
+            return None
+        ahora = time.monotonic()
+        entradas[:] = [e for e in entradas if ahora - e[3] < self.cache_ttl]
+        norma = math.sqrt(sum(x * x for x in query_embedding))
+        if not norma:
+            return None
+        mejor, mejor_similitud = None, self.cache_similitud
+        for vector, norma_vector, respuesta_cruda, _ in entradas:
+            if len(vector) != len(query_embedding):
+                continue
+            similitud = sum(a * b for a, b in zip(vector, query_embedding)) / (norma * norma_vector)
+            if similitud >= mejor_similitud:
+                mejor, mejor_similitud = respuesta_cruda, similitud
+        return mejor
+
+    def _guardar_busqueda_en_cache(self, class_name, query_embedding, respuesta_cruda):
+        """Recuerda la respuesta de Weaviate para query_embedding (descarta las más antiguas)"""
+        norma = math.sqrt(sum(x * x for x in query_embedding))
+        if not norma:
+            return
+        entradas = self._cache_busquedas.setdefault(class_name, [])
+        entradas.append((query_embedding, norma, respuesta_cruda, time.monotonic()))
+        del entradas[:-self.cache_max_busquedas]
+
+    def limpiar_cache_busquedas(self, class_name=None):
+        """Olvida las búsquedas guardadas de class_name (o de todas las clases) y el esquema en caché"""
+        if class_name is None:
+            self._cache_busquedas.clear()
+        else:
+            self._cache_busquedas.pop(class_name, None)
+        self._esquema_cache = None
+
     def _prompt_llm(self, prompt):
         result = self.model_router._call_gpt4(prompt, max_tokens=1024, temperature=0)
         if result["success"]:
@@ -50,6 +94,12 @@ class FragmentQueryAgent:
         log = {"estrategia": "busqueda_fragmentos_hibrida", "intentos": []}
         class_name = f"CodeFragments_{proyecto}"
         
+        # Pregunta vacía: sin embedding, búsqueda ni llamadas al LLM
+        if not pregunta or not pregunta.strip():
+            log["respuesta_final"] = "Escribe una pregunta sobre el proyecto para buscar fragmentos relevantes."
+            log["estrategia_exitosa"] = "ninguna"
+            return log
+        
         # Verificar que la clase existe
         esquema = self._get_schema()
         clases_disponibles = [c['class'] for c in esquema.get('classes', [])]
@@ -98,18 +148,24 @@ class FragmentQueryAgent:
         
         resultado["query_embedding_preview"] = query_embedding[:5]
         
-        # Búsqueda semántica
-        respuesta_cruda = (
-            self.weaviate_client.query
-            .get(class_name, [
-                'fileName', 'filePath', 'type', 'functionName', 'startLine', 'endLine',
-                'content', 'description', 'module', 'language', 'framework', 'complexity',
-                'parameters', 'returnType'
-            ])
-            .with_near_vector({"vector": query_embedding})
-            .with_limit(10)
-            .do()
-        )
+        # Búsqueda semántica (o la de una pregunta reciente casi idéntica)
+        respuesta_cruda = self._busqueda_en_cache(class_name, query_embedding)
+        if respuesta_cruda is not None:
+            resultado["cache_semantica"] = True
+        else:
+            respuesta_cruda = (
+                self.weaviate_client.query
+                .get(class_name, [
+                    'fileName', 'filePath', 'type', 'functionName', 'startLine', 'endLine',
+                    'content', 'description', 'module', 'language', 'framework', 'complexity',
+                    'parameters', 'returnType'
+                ])
+                .with_near_vector({"vector": query_embedding})
+                .with_limit(10)
+                .do()
+            )
+            if 'errors' not in respuesta_cruda:
+                self._guardar_busqueda_en_cache(class_name, query_embedding, respuesta_cruda)
         
         resultado["respuesta_cruda"] = respuesta_cruda
         
@@ -231,30 +287,32 @@ Responde de manera clara y técnica en español:"""
         if not fragmentos:
             return "No se encontraron fragmentos relevantes."
         
-        contexto = f"=== FRAGMENTOS RELEVANTES PARA: '{pregunta}' ===\n\n"
+        partes = [f"=== FRAGMENTOS RELEVANTES PARA: '{pregunta}' ===\n\n"]
         
         for i, fragment in enumerate(fragmentos[:8], 1):  # Limitar a 8 para no saturar
-            contexto += f"FRAGMENTO {i}:\n"
-            contexto += f"  📁 Archivo: {fragment.get('fileName', 'N/A')}\n"
-            contexto += f"  📍 Ubicación: {fragment.get('filePath', 'N/A')} (líneas {fragment.get('startLine', 'N/A')}-{fragment.get('endLine', 'N/A')})\n"
-            contexto += f"  🏷️  Tipo: {fragment.get('type', 'N/A')}\n"
-            contexto += f"  🔧 Función/Clase: {fragment.get('functionName', 'N/A')}\n"
-            contexto += f"  📦 Módulo: {fragment.get('module', 'N/A')}\n"
-            contexto += f"  💻 Lenguaje: {fragment.get('language', 'N/A')}\n"
-            contexto += f"  📊 Complejidad: {fragment.get('complexity', 'N/A')}\n"
-            contexto += f"  📝 Descripción: {fragment.get('description', 'N/A')}\n"
-            
             # Mostrar contenido truncado
             content = fragment.get('content', '')
             if len(content) > 400:
                 content = content[:400] + "..."
-            contexto += f"  💾 Contenido:\n{content}\n"
-            contexto += f"  {'-' * 50}\n\n"
+            
+            partes.append(
+                f"FRAGMENTO {i}:\n"
+                f"  📁 Archivo: {fragment.get('fileName', 'N/A')}\n"
+                f"  📍 Ubicación: {fragment.get('filePath', 'N/A')} (líneas {fragment.get('startLine', 'N/A')}-{fragment.get('endLine', 'N/A')})\n"
+                f"  🏷️  Tipo: {fragment.get('type', 'N/A')}\n"
+                f"  🔧 Función/Clase: {fragment.get('functionName', 'N/A')}\n"
+                f"  📦 Módulo: {fragment.get('module', 'N/A')}\n"
+                f"  💻 Lenguaje: {fragment.get('language', 'N/A')}\n"
+                f"  📊 Complejidad: {fragment.get('complexity', 'N/A')}\n"
+                f"  📝 Descripción: {fragment.get('description', 'N/A')}\n"
+                f"  💾 Contenido:\n{content}\n"
+                f"  {'-' * 50}\n\n"
+            )
         
         if len(fragmentos) > 8:
-            contexto += f"... y {len(fragmentos) - 8} fragmentos más.\n"
+            partes.append(f"... y {len(fragmentos) - 8} fragmentos más.\n")
         
-        return contexto
+        return ''.join(partes)
 
 class PromptGenerator:
     """Generador de prompts para diferentes tipos de consultas"""
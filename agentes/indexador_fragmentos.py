@@ -2,16 +2,219 @@ import os
 import ast
 import json
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 import re
 import hashlib
+import mmap
 import weaviate
 from datetime import datetime, timezone
 import uuid
 import time
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+from collections import OrderedDict
+from bisect import bisect_right
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from .cache_embeddings import EmbeddingCache
+
+try:
+    import orjson  # Opcional: serialización JSON más rápida para las peticiones a Ollama
+except ImportError:
+    orjson = None
+
+try:
+    import re2  # Opcional: google-re2, motor sin backtracking para los escaneos de archivo completo
+except ImportError:
+    re2 = None
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _json_dumps(payload) -> bytes:
+    """Serializa el cuerpo de una petición (orjson si está instalado)"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode('utf-8')
+
+
+def _json_loads(data: bytes):
+    """Parsea el cuerpo de una respuesta (orjson si está instalado)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _compile_scan_pattern(pattern: str):
+    """
+    Compila un patrón que se recorre sobre archivos completos: con re2 (tiempo lineal)
+    si está instalado y soporta el patrón, o con re. Los flags van inline en el patrón.
+    """
+    if re2 is not None:
+        try:
+            return re2.compile(pattern)
+        except Exception:
+            pass
+    return re.compile(pattern)
+
+
+# Incrementar cuando cambie la lógica de extracción para invalidar la caché de fragmentos
+FRAGMENT_CACHE_VERSION = 2
+
+# Filtros de archivos a indexar
+_IGNORED_EXTS = frozenset({
+    '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.bmp', '.tiff', '.webp',
+    '.exe', '.dll', '.so', '.bin', '.obj', '.class', '.pyc', '.pyo', '.zip', '.tar', '.gz', '.rar', '.7z',
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.mp3', '.mp4', '.avi', '.mov', '.mkv',
+    '.log', '.tmp', '.bak', '.swp', '.lock', '.db', '.sqlite', '.woff', '.woff2', '.eot', '.ttf', '.otf',
+    '.DS_Store', '.plist', '.sublime-workspace', '.sublime-project', '.iml', '.idea', '.vs', '.vscode',
+    '.env', '.sample', '.min.js', '.map'
+})
+_CODE_EXTS = frozenset({
+    '.js', '.ts', '.jsx', '.tsx', '.py', '.java', '.cs', '.php', '.rb', '.go', '.rs', '.cpp', '.c',
+    '.html', '.htm', '.vue', '.css', '.scss', '.sass'
+})
+# Lenguaje por extensión (ver _detect_language)
+_LANGUAGE_BY_EXT = {
+    '.js': 'javascript', '.ts': 'typescript', '.jsx': 'javascript', '.tsx': 'typescript',
+    '.html': 'html', '.htm': 'html', '.css': 'css', '.scss': 'scss', '.sass': 'sass',
+    '.py': 'python', '.java': 'java', '.cs': 'csharp', '.php': 'php', '.rb': 'ruby',
+    '.go': 'go', '.rs': 'rust', '.cpp': 'cpp', '.c': 'c', '.vue': 'vue'
+}
+_IGNORED_DIRS = frozenset({
+    'node_modules', 'bower_components', '.git', 'dist', 'build', 'coverage', 'nbproject', '.idea', '.vscode', '__pycache__'
+})
+
+# Configuración de vectorIndexConfig para guardar los vectores comprimidos en Weaviate:
+# PQ (product quantization, se entrena con los primeros trainingLimit vectores) o BQ (1 bit por dimensión)
+VECTOR_INDEX_COMPRESSION = {
+    'pq': {"pq": {"enabled": True, "trainingLimit": 100000}},
+    'bq': {"bq": {"enabled": True}},
+}
+
+# Mensajes de log que se muestran aunque no esté activo el modo verbose
+_IMPORTANT_LOG_PREFIXES = ('🚀', '✅', '❌', '📊', '🏁', '💾', '📦', '🔍')
+
+# Espacio de nombres de los UUID de fragmentos (uuid5 por proyecto, ruta y líneas)
+FRAGMENT_UUID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "samara-mpac/code-fragments")
+
+# Bytes leídos al inicio de cada archivo para decidir si se indexa
+FILE_HEAD_BYTES = 4096
+# A partir de este tamaño los archivos se leen con mmap
+MMAP_MIN_BYTES = 1024 * 1024
+# Fragmentos pedidos a Weaviate por página al listar un proyecto completo
+LIST_PAGE_SIZE = 1000
+
+# Bytes ASCII imprimibles: lo que quede tras eliminarlos indica contenido binario
+_PRINTABLE_BYTES = bytes(range(32, 127)) + b'\n\r\t'
+
+# Patrones precompilados (se evalúan por línea en cada archivo)
+_JS_FUNCTION_PATTERNS = [re.compile(p) for p in (
+    r'function\s+\w+',
+    r'const\s+\w+\s*=\s*\(',
+    r'let\s+\w+\s*=\s*\(',
+    r'var\s+\w+\s*=\s*\(',
+    r'\w+\s*:\s*function',
+    r'\w+\s*=>\s*{',
+    r'async\s+function',
+    r'export\s+function',
+    r'export\s+const\s+\w+\s*='
+)]
+_JS_CLASS_PATTERNS = [re.compile(p) for p in (
+    r'class\s+\w+',
+    r'export\s+class\s+\w+',
+    r'export\s+default\s+class\s+\w+'
+)]
+_COMPONENT_PATTERNS = {
+    'react': [re.compile(p) for p in (
+        r'const\s+\w+\s*=\s*\(\s*\)\s*=>\s*{',
+        r'function\s+\w+\s*\(\s*\)\s*{.*return.*<',
+        r'export\s+default\s+function\s+\w+'
+    )],
+    'vue': [re.compile(p) for p in (
+        r'export\s+default\s*{',
+        r'Vue\.component\s*\(',
+        r'<script.*setup'
+    )],
+    'polymer': [re.compile(p) for p in (
+        r'Polymer\s*\(',
+        r'class\s+\w+\s+extends\s+PolymerElement'
+    )]
+}
+_ENDPOINT_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'app\.(get|post|put|delete|patch)\s*\(',
+    r'router\.(get|post|put|delete|patch)\s*\(',
+    r'@(Get|Post|Put|Delete|Patch)\s*\(',
+    r'@app\.route\s*\(',
+    r'def\s+\w+.*@.*route'
+)]
+_JS_FUNCTION_NAME_PATTERNS = [re.compile(p) for p in (
+    r'function\s+(\w+)',                 # function nombre()
+    r'(?:const|let|var)\s+(\w+)\s*=',    # const nombre = () =>
+    r'(\w+)\s*:\s*function',             # nombre: function()
+    r'export\s+function\s+(\w+)'         # export function nombre()
+)]
+# Alternativa única con todos los detectores JS: localiza las líneas candidatas
+# recorriendo el archivo completo en una sola búsqueda
+_JS_CANDIDATE_RE = _compile_scan_pattern('(?m)' + '|'.join(
+    [pattern.pattern for pattern in _JS_FUNCTION_PATTERNS + _JS_CLASS_PATTERNS]
+    + [pattern.pattern for patterns in _COMPONENT_PATTERNS.values() for pattern in patterns]
+    + [f'(?i:{pattern.pattern})' for pattern in _ENDPOINT_PATTERNS]
+    + [r'^\s*(?:import|export|from) ']
+))
+
+# Línea "[n] descripción" de la respuesta a una consulta de descripciones por lote
+_DESCRIPTION_LINE_RE = re.compile(r'^\s*\**\[(\d+)\]\**\s*[:.\-]?\s*(.+?)\s*$', re.MULTILINE)
+
+# Tokens relevantes para emparejar llaves en JS: comentarios, cadenas, template
+# literals y regex literales se consumen enteros para ignorar las llaves que contengan.
+# Una regex no puede empezar tras '<' ni '}': en JSX ese '/' es el de '</tag>' o '{x}/>'.
+# Las comillas simples/dobles deben cerrarse en la misma línea: una sin pareja (el apóstrofo
+# de "Don't" en un texto JSX) se salta y las llaves siguientes se siguen contando
+_JS_BRACE_TOKEN_RE = re.compile(r'''
+    //[^\n]*
+  | /\*.*?(?:\*/|\Z)
+  | "(?:[^"\\\n]|\\.)*"
+  | '(?:[^'\\\n]|\\.)*'
+  | `(?:[^`\\]|\\.)*`?
+  | (?:(?<=[(,=:\[!&|?{;+\-*%>~^])|(?<=\breturn))\s*/(?![*/])(?:[^/\\\n\[]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/
+  | [{}]
+''', re.VERBOSE | re.DOTALL)
+_PYTHON_FUNCTION_DECL_RE = re.compile(r'^\s*def\s+\w+\s*\(')
+_PYTHON_CLASS_DECL_RE = re.compile(r'^\s*class\s+\w+')
+_PYTHON_DEF_NAME_RE = re.compile(r'def\s+(\w+)')
+_PYTHON_CLASS_NAME_RE = re.compile(r'class\s+(\w+)')
+_PYTHON_PARAMS_RE = re.compile(r'def\s+\w+\s*\(([^)]*)\)')
+# Cabecera completa (tipo, nombre y parámetros si cierran en la misma línea) en un solo match
+_PYTHON_HEADER_RE = re.compile(r'\s*(def|class)\s+(\w+)\s*(\()?(?:(?<=\()([^)]*)\))?')
+# Librerías tan comunes que sus imports no se indexan como fragmento
+_COMMON_PYTHON_LIBS = ('os', 'sys', 'json', 're', 'time', 'datetime')
+_CONTROL_STRUCTURES_RE = re.compile(r'\b(if|for|while|switch|try|catch)\b')
+_NESTED_FUNCTIONS_RE = re.compile(r'function\s+\w+|=>\s*{')
+_IMPORT_FROM_RE = re.compile(r'import.*?from\s+[\'"]([^\'"]+)[\'"]')
+_REQUIRE_RE = re.compile(r'require\s*\(\s*[\'"]([^\'"]+)[\'"]\s*\)')
+_PARAMETERS_RE = re.compile(r'\(([^)]*)\)')
+_JS_RETURN_RE = re.compile(r'return\s+([^;]+)')
+_PROJECT_NAME_INVALID_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+# Agente propio de cada proceso de extracción (ver _init_extraction_worker)
+_worker_agent = None
+
+
+def _init_extraction_worker(agent):
+    """Inicializador de los procesos de extracción: recibe una copia del agente sin conexiones"""
+    global _worker_agent
+    _worker_agent = agent
+
+
+def _parse_fragments_in_worker(file_path: str, content: str, language: str) -> List[Dict]:
+    """Extrae los fragmentos de un archivo dentro de un proceso del pool"""
+    return _worker_agent._parse_code_fragments(file_path, content, language)
+
 
 class CodeAnalysisAgent:
     """
@@ -21,7 +224,13 @@ class CodeAnalysisAgent:
     
     def __init__(self, ollama_url: str = "http://localhost:11434", weaviate_url: str = "http://localhost:8080", 
                  max_workers: int = None, ollama_max_concurrent: int = 2, 
-                 file_timeout: int = 60, ollama_timeout: int = 30):
+                 file_timeout: int = 60, ollama_timeout: int = 30,
+                 batch_size: int = 100, batch_workers: int = None,
+                 cache_dir: Optional[str] = ".samara_cache", extract_processes: int = None,
+                 embedding_batch_size: int = 64, index_workers: int = None,
+                 max_file_size: Optional[int] = 2 * 1024 * 1024, embedding_cache_size: int = 50000,
+                 vector_compression: Optional[str] = None, generation_cache_size: int = 1024,
+                 weaviate_client=None):
         self.ollama_url = ollama_url
         self.weaviate_url = weaviate_url
         self._verbose_mode = False
@@ -34,19 +243,69 @@ class CodeAnalysisAgent:
         # Configuración de threading personalizable
         cpu_count = os.cpu_count() or 4  # Fallback a 4 si os.cpu_count() devuelve None
         self.max_workers = max_workers or min(16, cpu_count)
+        # Procesos para la extracción (CPU pura, limitada por el GIL en threads); 0 o 1 la hace en el thread
+        self.extract_processes = cpu_count if extract_processes is None else extract_processes
+        self._extract_pool = None
+        # Serializa el reciclado del pool; el semáforo deja en vuelo tantos archivos como procesos,
+        # así file_timeout cuenta desde que un proceso toma el archivo y no desde la cola
+        self._extract_pool_lock = threading.Lock()
+        self._extract_slots = None
+        # Threads de indexación (embeddings + lote de Weaviate); por defecto, tantos como consultas simultáneas a Ollama
+        self.index_workers = index_workers or ollama_max_concurrent or 2
         self.file_timeout = file_timeout
+        # Archivos más grandes (bytes) se descartan al recorrer el proyecto, sin abrirlos; None o 0 desactiva el límite
+        self.max_file_size = max_file_size
         self.ollama_timeout = ollama_timeout
+        # Textos por petición a /api/embed (los fragmentos de un archivo van juntos hasta este límite)
+        self.embedding_batch_size = max(1, embedding_batch_size or 64)
         
         # Threading y sincronización
         self._log_lock = threading.Lock()
-        self._counter_lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self._batch_errors = []
         self._ollama_semaphore = threading.Semaphore(ollama_max_concurrent or 2)
+        # Embeddings ya calculados por hash del texto (fragmentos repetidos entre archivos),
+        # LRU acotado a embedding_cache_size entradas
+        self.embedding_cache_size = embedding_cache_size
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
+        # Segundo nivel persistente (SQLite en cache_dir): embeddings reutilizados entre ejecuciones
+        self.embedding_model = "nomic-embed-text"
+        self._embedding_store = self._open_embedding_store(cache_dir)
+        # Respuestas de /api/generate por (modelo, prompt): prompts repetidos no vuelven a Ollama
+        self.generation_cache_size = generation_cache_size
+        self._generation_cache = OrderedDict()
+        self._generation_cache_lock = threading.Lock()
+        # Solo lo actualiza el thread que recoge los resultados (no necesita lock)
         self._indexed_fragments_count = 0
-        
-        # Conectar a Weaviate
+
+        # Sesión HTTP compartida para Ollama: reutiliza conexiones keep-alive entre threads
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers * 2, max_retries=0)
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
+        
+        # Compresión de vectores en el índice de Weaviate: None, 'pq' o 'bq' (ver VECTOR_INDEX_COMPRESSION)
+        if vector_compression and vector_compression not in VECTOR_INDEX_COMPRESSION:
+            raise ValueError(f"vector_compression debe ser uno de {sorted(VECTOR_INDEX_COMPRESSION)}")
+        self.vector_compression = vector_compression or None
+        # Callback opcional (class_name) cuando cambian los datos de un proyecto en Weaviate
+        # (re-indexación o borrado); FragmentQueryAgent lo usa para invalidar su caché de búsquedas
+        self.on_project_data_changed = None
+
+        # Lotes de Weaviate: un cliente propio se configura ya; uno recibido solo al indexar por
+        # primera vez (_ensure_weaviate_batch), para no pisar la configuración de quien lo comparte
+        self._batch_settings = (batch_size, batch_workers)
+        self._batch_configured = False
+
+        # Conectar a Weaviate (o reutilizar el cliente recibido, con sus conexiones abiertas)
         try:
-            self.weaviate_client = weaviate.Client(weaviate_url)
-            print(f"✅ Conectado a Weaviate en {weaviate_url}")
+            if weaviate_client is not None:
+                self.weaviate_client = weaviate_client
+            else:
+                self.weaviate_client = weaviate.Client(weaviate_url)
+                print(f"✅ Conectado a Weaviate en {weaviate_url}")
+                self._ensure_weaviate_batch()
         except Exception as e:
             print(f"❌ Error conectando a Weaviate: {e}")
             self.weaviate_client = None
@@ -55,21 +314,67 @@ class CodeAnalysisAgent:
         self.max_function_lines = 100  # Funciones > 100 líneas se fragmentan
         self.fragment_chunk_size = 50  # Tamaño de chunks para funciones largas
         self.fragment_overlap = 10     # Líneas de solapamiento entre chunks
+        self.description_batch_size = 8  # Fragmentos descritos por consulta a Ollama
+        self.description_max_tokens = 96  # Tokens generados como máximo por descripción (num_predict); None = sin límite
+        self.vector_precision = 4        # Cifras significativas de los vectores enviados (~float16); None = sin recortar
+
+        # Caché en disco de fragmentos extraídos (None la desactiva)
+        self._fragment_cache_dir = Path(cache_dir) / "fragments" if cache_dir else None
+
+    def _open_embedding_store(self, cache_dir: Optional[str]) -> Optional[EmbeddingCache]:
+        """Abre la caché de embeddings en disco (None si cache_dir es None o no se puede abrir)"""
+        if not cache_dir:
+            return None
+        try:
+            return EmbeddingCache(Path(cache_dir) / "embeddings.sqlite3", self.embedding_model)
+        except Exception as e:
+            print(f"⚠️  No se pudo abrir la caché de embeddings en disco: {e}")
+            return None
+
+    def _embedding_key(self, text: str) -> bytes:
+        """Clave de la caché de embeddings: hash de 16 bytes del texto exacto que se embebe"""
+        return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+    def _cached_embeddings(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Embeddings ya en caché para las claves dadas (quedan como los más recientes del LRU)"""
+        found = {}
+        with self._embedding_cache_lock:
+            for key in keys:
+                embedding = self._embedding_cache.get(key)
+                if embedding is not None:
+                    self._embedding_cache.move_to_end(key)
+                    found[key] = embedding
+        return found
+
+    def _store_embeddings(self, items: List[Tuple[bytes, List[float]]]):
+        """Guarda embeddings en la caché descartando los menos usados al superar embedding_cache_size"""
+        with self._embedding_cache_lock:
+            for key, embedding in items:
+                if embedding:
+                    self._embedding_cache[key] = embedding
+                    self._embedding_cache.move_to_end(key)
+            while len(self._embedding_cache) > max(0, self.embedding_cache_size or 0):
+                self._embedding_cache.popitem(last=False)
 
     def _get_embedding(self, text: str) -> List[float]:
-        """Obtiene embedding usando Ollama con rate limiting"""
+        """Obtiene embedding usando Ollama (atajo de _get_embeddings_batch para un solo texto)"""
+        return self._get_embeddings_batch([text])[0]
+
+    def _request_embedding(self, text: str) -> List[float]:
+        """Pide un embedding a Ollama con rate limiting"""
         with self._ollama_semaphore:
             try:
-                response = requests.post(
+                response = self._http.post(
                     f"{self.ollama_url}/api/embeddings",
-                    json={
-                        "model": "nomic-embed-text",
+                    data=_json_dumps({
+                        "model": self.embedding_model,
                         "prompt": text
-                    },
+                    }),
+                    headers=_JSON_HEADERS,
                     timeout=self.ollama_timeout
                 )
                 if response.status_code == 200:
-                    return response.json()["embedding"]
+                    return _json_loads(response.content)["embedding"]
                 else:
                     print(f"Error al obtener embedding: {response.status_code}")
                     return []
@@ -77,6 +382,185 @@ class CodeAnalysisAgent:
                 print(f"Error conectando con Ollama: {e}")
                 return []
 
+    def _get_embeddings_batch(self, texts: List[str], batch_size: int = None) -> List[List[float]]:
+        """
+        Obtiene embeddings de varios textos. Los textos repetidos (en el lote, ya
+        vistos en esta ejecución o en una anterior) salen de la caché en memoria o
+        de la de disco y solo se piden una vez a Ollama.
+        """
+        keys = [self._embedding_key(text) for text in texts]
+        found = self._cached_embeddings(keys)
+        
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        
+        if missing and self._embedding_store is not None:
+            stored = self._embedding_store.batch_get(list(missing))
+            if stored:
+                self._store_embeddings(list(stored.items()))
+                found.update(stored)
+                for key in stored:
+                    del missing[key]
+        
+        if missing:
+            new_embeddings = self._request_embeddings_batch(list(missing.values()), batch_size or self.embedding_batch_size)
+            computed = list(zip(missing, new_embeddings))
+            self._store_embeddings(computed)
+            if self._embedding_store is not None:
+                self._embedding_store.put_many(computed)
+            found.update(computed)
+        
+        return [found[key] for key in keys]
+
+    def _request_embeddings_batch(self, texts: List[str], batch_size: int = 64) -> List[List[float]]:
+        """
+        Pide embeddings usando el endpoint por lotes de Ollama (/api/embed).
+        El semáforo limita lotes completos en lugar de prompts individuales.
+        Si el endpoint no está disponible (Ollama antiguo), cae a _request_embedding por texto.
+        """
+        embeddings = []
+        for i in range(0, len(texts), batch_size):
+            chunk = texts[i:i + batch_size]
+            chunk_embeddings = None
+            with self._ollama_semaphore:
+                try:
+                    response = self._http.post(
+                        f"{self.ollama_url}/api/embed",
+                        data=_json_dumps({
+                            "model": self.embedding_model,
+                            "input": chunk
+                        }),
+                        headers=_JSON_HEADERS,
+                        timeout=self.ollama_timeout
+                    )
+                    if response.status_code == 200:
+                        chunk_embeddings = _json_loads(response.content).get("embeddings")
+                    else:
+                        print(f"Error al obtener embeddings por lote: {response.status_code}")
+                except Exception as e:
+                    print(f"Error conectando con Ollama: {e}")
+
+            if not chunk_embeddings or len(chunk_embeddings) != len(chunk):
+                chunk_embeddings = [self._request_embedding(text) for text in chunk]
+            embeddings.extend(chunk_embeddings)
+        return embeddings
+
+    def _configure_weaviate_batch(self, batch_size: int = 100, num_workers: int = None):
+        """Configura la importación por lotes de Weaviate (tamaño dinámico y envíos concurrentes)"""
+        self.weaviate_client.batch.configure(
+            batch_size=batch_size,
+            dynamic=True,
+            num_workers=num_workers or 1,
+            timeout_retries=3,
+            callback=self._on_batch_results
+        )
+
+    def _ensure_weaviate_batch(self):
+        """Configura la importación por lotes la primera vez que se necesita"""
+        if not self._batch_configured:
+            self._configure_weaviate_batch(*self._batch_settings)
+            self._batch_configured = True
+
+    def _on_batch_results(self, results: Optional[List[Dict]]):
+        """Callback del lote de Weaviate: registra los fragmentos rechazados"""
+        for item in results or []:
+            errors = (item.get("result") or {}).get("errors")
+            if errors:
+                message = "; ".join(e.get("message", "") for e in errors.get("error", []))
+                function_name = (item.get("properties") or {}).get("functionName")
+                self._batch_errors.append(f"Error indexando fragmento {function_name}: {message}")
+                self._log(f"❌ Error indexando fragmento {function_name}: {message}")
+
+    def _flush_weaviate_batch(self):
+        """Envía a Weaviate los fragmentos pendientes en el lote"""
+        if not self.weaviate_client:
+            return
+        with self._batch_lock:
+            try:
+                self.weaviate_client.batch.flush()
+            except Exception as e:
+                self._log(f"❌ Error enviando lote a Weaviate: {e}")
+
+    def __getstate__(self):
+        """Estado copiado a los procesos de extracción: sin conexiones, locks ni pools"""
+        state = self.__dict__.copy()
+        for key in ('weaviate_client', '_http', '_extract_pool', '_extract_pool_lock', '_extract_slots',
+                    '_log_lock', '_batch_lock',
+                    '_ollama_semaphore', '_batch_errors', '_embedding_cache', '_embedding_cache_lock',
+                    '_generation_cache', '_generation_cache_lock', '_embedding_store'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.weaviate_client = None
+        self._http = None
+        self._extract_pool = None
+        self._extract_pool_lock = threading.Lock()
+        self._extract_slots = None
+        self._log_lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self._ollama_semaphore = threading.Semaphore(1)
+        self._batch_errors = []
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
+        self._embedding_store = None
+        self._generation_cache = OrderedDict()
+        self._generation_cache_lock = threading.Lock()
+
+    def _start_extraction_pool(self):
+        """Arranca el pool de procesos de extracción si está habilitado"""
+        if self.extract_processes <= 1:
+            return
+        self._extract_slots = threading.BoundedSemaphore(self.extract_processes)
+        self._extract_pool = self._create_extraction_pool()
+        if self._extract_pool is not None:
+            self._log(f"🧩 Extracción de fragmentos en {self.extract_processes} procesos", force=True)
+
+    def _create_extraction_pool(self) -> Optional[ProcessPoolExecutor]:
+        """Crea el pool de procesos de extracción (None si no se puede: se extrae en threads)"""
+        try:
+            return ProcessPoolExecutor(max_workers=self.extract_processes,
+                                       initializer=_init_extraction_worker,
+                                       initargs=(self,))
+        except Exception as e:
+            self._log(f"⚠️  No se pudo iniciar el pool de procesos, se extrae en threads: {e}", force=True)
+            return None
+
+    def _recycle_extraction_pool(self, pool: ProcessPoolExecutor, reason: str):
+        """
+        Sustituye el pool si sigue siendo el activo: termina sus procesos (uno puede seguir
+        colgado en un archivo, cancel() no lo detiene) y arranca otro con todos los procesos libres.
+        Los archivos en vuelo en el pool viejo reciben BrokenProcessPool y se extraen en su thread.
+        """
+        with self._extract_pool_lock:
+            if self._extract_pool is not pool:
+                return  # Otro thread ya lo recicló
+            self._log(f"♻️  Reiniciando el pool de extracción: {reason}", force=True)
+            terminate_workers = getattr(pool, 'terminate_workers', None)  # Python 3.14+
+            if terminate_workers is not None:
+                terminate_workers()
+            else:
+                for process in list((getattr(pool, '_processes', None) or {}).values()):
+                    process.terminate()
+                pool.shutdown(wait=False, cancel_futures=True)
+            self._extract_pool = self._create_extraction_pool()
+
+    def _stop_extraction_pool(self):
+        """Detiene el pool de procesos de extracción"""
+        if self._extract_pool is not None:
+            self._extract_pool.shutdown(wait=True)
+            self._extract_pool = None
+
+    def close(self):
+        """Cierra la sesión HTTP compartida con Ollama y la caché de embeddings en disco"""
+        self._http.close()
+        if self._embedding_store is not None:
+            self._embedding_store.close()
+            self._embedding_store = None
+
     def create_weaviate_schema(self, project_name: str):
         """
         Crea el esquema de fragmentos de código en Weaviate
@@ -86,17 +570,6 @@ class CodeAnalysisAgent:
             
         class_name = f"CodeFragments_{self._sanitize_project_name(project_name)}"
         
-        # Verificar si la clase ya existe
-        try:
-            existing_schema = self.weaviate_client.schema.get()
-            existing_classes = [cls['class'] for cls in existing_schema.get('classes', [])]
-            
-            if class_name in existing_classes:
-                print(f"⚠️  La clase {class_name} ya existe. Eliminándola para crear una nueva...")
-                self.weaviate_client.schema.delete_class(class_name)
-        except Exception as e:
-            print(f"Error verificando esquema existente: {e}")
-        
         # Esquema de Fragmentos de Código
         schema = {
             "class": class_name,
@@ -135,6 +608,24 @@ class CodeAnalysisAgent:
             ]
         }
         
+        if self.vector_compression:
+            schema["vectorIndexConfig"] = VECTOR_INDEX_COMPRESSION[self.vector_compression]
+        
+        # Verificar si la clase ya existe: si es compatible se vacía conservando el índice
+        # vectorial; si no (propiedades o compresión distintas), se elimina y se recrea
+        try:
+            existing_schema = self.weaviate_client.schema.get()
+            existing = next((cls for cls in existing_schema.get('classes', []) if cls['class'] == class_name), None)
+            
+            if existing is not None:
+                if self._class_matches_schema(existing, schema) and self._clear_class_objects(class_name, project_name):
+                    print(f"♻️  La clase {class_name} ya existe. Reutilizándola vacía")
+                    return True
+                print(f"⚠️  La clase {class_name} ya existe. Eliminándola para crear una nueva...")
+                self.weaviate_client.schema.delete_class(class_name)
+        except Exception as e:
+            print(f"Error verificando esquema existente: {e}")
+        
         try:
             self.weaviate_client.schema.create_class(schema)
             print(f"✅ Esquema de fragmentos creado para proyecto: {class_name}")
@@ -143,86 +634,213 @@ class CodeAnalysisAgent:
             print(f"❌ Error creando esquema: {e}")
             return False
 
+    def _class_matches_schema(self, existing: Dict, schema: Dict) -> bool:
+        """Indica si la clase existente tiene todas las propiedades del esquema y la misma compresión de vectores"""
+        existing_props = {prop['name'] for prop in existing.get('properties', [])}
+        if not all(prop['name'] in existing_props for prop in schema['properties']):
+            return False
+        index_config = existing.get('vectorIndexConfig') or {}
+        for method in VECTOR_INDEX_COMPRESSION:
+            enabled = bool((index_config.get(method) or {}).get('enabled'))
+            if enabled != (method == self.vector_compression):
+                return False
+        return True
+
+    def _clear_class_objects(self, class_name: str, project_name: str) -> bool:
+        """Elimina los fragmentos del proyecto con batch.delete_objects, conservando la clase"""
+        where_filter = {
+            "path": ["projectName"],
+            "operator": "Equal",
+            "valueText": project_name
+        }
+        try:
+            # Weaviate limita los objetos borrados por llamada (QUERY_MAXIMUM_RESULTS), repetir hasta vaciar
+            deleted = 0
+            while True:
+                result = self.weaviate_client.batch.delete_objects(
+                    class_name=class_name,
+                    where=where_filter,
+                    output="minimal"
+                )
+                results = result.get("results", {})
+                deleted += results.get("successful", 0)
+                if not results.get("matches") or not results.get("successful"):
+                    break
+            self._log(f"🗑️  {deleted} fragmentos previos eliminados de {class_name}")
+            return True
+        except Exception as e:
+            print(f"⚠️  Borrado por lotes falló en {class_name}: {e}")
+            return False
+
+    def _notify_project_data_changed(self, project_name: str):
+        """Avisa a on_project_data_changed (si hay) de que la clase del proyecto cambió"""
+        if self.on_project_data_changed is None:
+            return
+        try:
+            self.on_project_data_changed(f"CodeFragments_{self._sanitize_project_name(project_name)}")
+        except Exception as e:
+            print(f"⚠️  Error notificando cambios del proyecto {project_name}: {e}")
+
     def _sanitize_project_name(self, project_name: str) -> str:
         """Sanitiza el nombre del proyecto para usarlo como clase en Weaviate"""
-        sanitized = re.sub(r'[^a-zA-Z0-9_]', '_', project_name)
+        sanitized = _PROJECT_NAME_INVALID_RE.sub('_', project_name)
         if sanitized and not sanitized[0].isalpha():
             sanitized = f"Proj_{sanitized}"
         return sanitized or "UnknownProject"
 
     def _log(self, message: str, force: bool = False):
         """Log thread-safe con soporte para verbose mode"""
-        important_prefixes = ['🚀', '✅', '❌', '📊', '🏁', '💾', '📦', '🔍']
-        is_important = force or any(message.startswith(prefix) for prefix in important_prefixes)
+        is_important = force or message.startswith(_IMPORTANT_LOG_PREFIXES)
         
         if is_important or self._verbose_mode:
             with self._log_lock:
                 print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
 
-    def _should_index_file(self, file_path: str, relative_path: str, content: str) -> bool:
-        """Decide si un archivo es relevante para indexar"""
-        # Extensiones irrelevantes
-        ignored_exts = [
-            '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.bmp', '.tiff', '.webp',
-            '.exe', '.dll', '.so', '.bin', '.obj', '.class', '.pyc', '.pyo', '.zip', '.tar', '.gz', '.rar', '.7z',
-            '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.mp3', '.mp4', '.avi', '.mov', '.mkv',
-            '.log', '.tmp', '.bak', '.swp', '.lock', '.db', '.sqlite', '.woff', '.woff2', '.eot', '.ttf', '.otf',
-            '.DS_Store', '.plist', '.sublime-workspace', '.sublime-project', '.iml', '.idea', '.vs', '.vscode', 
-            '.env', '.sample', '.min.js', '.map'
-        ]
-        
-        ext = Path(file_path).suffix.lower()
-        if ext in ignored_exts:
-            reason = f"Extensión irrelevante ({ext}): {relative_path}"
-            self._log(f"[IGNORADO] {reason}")
-            self._log_to_file("ignored", reason)
-            return False
-        
-        # Archivos ocultos o de sistema
-        if os.path.basename(file_path).startswith('.'):
-            reason = f"Archivo oculto: {relative_path}"
-            self._log(f"[IGNORADO] {reason}")
-            self._log_to_file("ignored", reason)
-            return False
+    def _iter_source_files(self, root: str, directory: str = None):
+        """
+        Recorre el proyecto con os.scandir descartando carpetas irrelevantes sin entrar en ellas.
+        Devuelve (file_path, relative_path) de los archivos de código no ocultos.
+        """
+        directory = directory or root
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir():
+                        # Igual que os.walk: no se siguen enlaces simbólicos a carpetas
+                        if entry.name not in _IGNORED_DIRS and not entry.is_symlink():
+                            subdirs.append(entry.path)
+                        continue
+                    
+                    relative_path = os.path.relpath(entry.path, root).replace('\\', '/')
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if ext in _IGNORED_EXTS:
+                        reason = f"Extensión irrelevante ({ext}): {relative_path}"
+                    elif ext not in _CODE_EXTS:
+                        reason = f"No es archivo de código ({ext}): {relative_path}"
+                    else:
+                        # Filtro por tamaño antes de enviar el archivo a un worker
+                        reason = self._file_size_rejection(entry, relative_path)
+                        if reason is None:
+                            yield entry.path, relative_path
+                            continue
+                    self._log(f"[IGNORADO] {reason}")
+                    self._log_to_file("ignored", reason)
+        except OSError as e:
+            self._log(f"⚠️  No se pudo recorrer: {directory} - {e}")
+            return
         
+        for subdir in subdirs:
+            yield from self._iter_source_files(root, subdir)
+
+    def _file_size_rejection(self, entry: os.DirEntry, relative_path: str) -> Optional[str]:
+        """Motivo para descartar el archivo por tamaño (solo hace un stat, sin abrirlo), o None si pasa"""
+        try:
+            file_size = entry.stat().st_size
+        except OSError as e:
+            return f"No se pudo leer el tamaño: {relative_path} - {e}"
+        if file_size < 10:
+            return f"Archivo vacío o muy pequeño ({file_size} bytes): {relative_path}"
+        if self.max_file_size and file_size > self.max_file_size:
+            return f"Archivo demasiado grande ({file_size} bytes): {relative_path}"
+        return None
+
+    def _read_source_file(self, file_path: str, file_size: int) -> str:
+        """
+        Lee un archivo como texto UTF-8 (errores ignorados, saltos de línea universales).
+        Los archivos grandes se decodifican desde un mmap en lugar de pasar por el buffer de lectura.
+        """
+        if file_size < MMAP_MIN_BYTES:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                return f.read()
+        with open(file_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                content = str(mapped, 'utf-8', 'ignore')
+        return content.replace('\r\n', '\n').replace('\r', '\n')
+
+    def _should_index_file(self, file_path: str, relative_path: str, head: bytes, file_size: int) -> bool:
+        """
+        Decide si un archivo de código es relevante mirando solo su tamaño y sus primeros
+        bytes (la ruta ya la filtró _iter_source_files); el archivo completo se lee después.
+        """
         # Archivos muy pequeños o vacíos
-        if len(content.strip()) < 10:
-            reason = f"Archivo vacío o muy pequeño ({len(content)} bytes): {relative_path}"
+        if file_size < 10 or (file_size <= len(head) and len(head.strip()) < 10):
+            reason = f"Archivo vacío o muy pequeño ({file_size} bytes): {relative_path}"
             self._log(f"[IGNORADO] {reason}")
             self._log_to_file("ignored", reason)
             return False
         
         # Archivos binarios
-        if '\x00' in content or not all(32 <= ord(c) <= 126 or c in '\n\r\t' for c in content[:100]):
+        text_head = head.decode('utf-8', errors='ignore')[:100]
+        if b'\x00' in head or text_head.encode('utf-8', 'surrogatepass').translate(None, _PRINTABLE_BYTES):
             reason = f"Archivo binario o no texto: {relative_path}"
             self._log(f"[IGNORADO] {reason}")
             self._log_to_file("ignored", reason)
             return False
         
-        # Carpetas irrelevantes
-        ignored_dirs = ['node_modules', 'bower_components', '.git', 'dist', 'build', 'coverage', 'nbproject', '.idea', '.vscode', '__pycache__']
-        if any(f"{os.sep}{d}{os.sep}" in file_path for d in ignored_dirs):
-            reason = f"Carpeta irrelevante en ruta: {relative_path}"
-            self._log(f"[IGNORADO] {reason}")
-            self._log_to_file("ignored", reason)
-            return False
-        
-        # Solo indexar archivos de código
-        code_extensions = ['.js', '.ts', '.jsx', '.tsx', '.py', '.java', '.cs', '.php', '.rb', '.go', '.rs', '.cpp', '.c', '.html', '.htm', '.vue', '.css', '.scss', '.sass']
-        if ext not in code_extensions:
-            reason = f"No es archivo de código ({ext}): {relative_path}"
-            self._log(f"[IGNORADO] {reason}")
-            self._log_to_file("ignored", reason)
-            return False
-        
         return True
 
     def _extract_code_fragments(self, file_path: str, content: str, language: str) -> List[Dict]:
         """
-        Extrae fragmentos de código del archivo según el tipo de contenido
+        Extrae fragmentos de código del archivo según el tipo de contenido.
+        Los archivos sin cambios se sirven desde la caché en disco; el resto se
+        analiza en el pool de procesos (si está activo) y se describe con Ollama.
+        """
+        cache_key = self._fragment_cache_key(file_path, content, language)
+        cached_fragments = self._load_cached_fragments(cache_key)
+        if cached_fragments is not None:
+            return cached_fragments
+
+        pool = self._extract_pool
+        if pool is not None:
+            fragments = self._parse_in_extraction_pool(pool, file_path, content, language)
+        else:
+            fragments = self._parse_code_fragments(file_path, content, language)
+        self._describe_fragments(fragments)
+
+        self._store_cached_fragments(cache_key, fragments)
+        return fragments
+
+    def _parse_in_extraction_pool(self, pool: ProcessPoolExecutor, file_path: str, content: str,
+                                  language: str) -> List[Dict]:
+        """
+        Extrae el archivo en el pool de procesos con un límite de file_timeout segundos.
+        Si se supera, el pool se recicla y se lanza TimeoutError; si el pool se rompe
+        (un proceso murió), se reinicia y el archivo se extrae en este thread.
+        """
+        slots = self._extract_slots
+        slots.acquire()
+        try:
+            future = pool.submit(_parse_fragments_in_worker, file_path, content, language)
+        except RuntimeError:
+            # Pool roto o ya reciclado por otro thread (BrokenProcessPool es un RuntimeError)
+            slots.release()
+            return self._parse_code_fragments(file_path, content, language)
+        future.add_done_callback(lambda _: slots.release())
+        
+        try:
+            return future.result(timeout=self.file_timeout)
+        except FuturesTimeoutError:
+            self._recycle_extraction_pool(pool, f"{file_path} superó {self.file_timeout}s")
+            raise TimeoutError(f"la extracción superó {self.file_timeout}s")
+        except BrokenProcessPool:
+            self._recycle_extraction_pool(pool, "un proceso de extracción terminó inesperadamente")
+            return self._parse_code_fragments(file_path, content, language)
+
+    def _parse_code_fragments(self, file_path: str, content: str, language: str) -> List[Dict]:
+        """
+        Análisis puro (sin red) del archivo: devuelve los fragmentos con la
+        descripción pendiente (None), para poder ejecutarse en otro proceso.
         """
         fragments = []
+        # Ruta con '/' y nombre de archivo: se calculan una vez y valen para todos los fragmentos
+        file_path = file_path.replace('\\', '/')
+        file_name = os.path.basename(file_path)
         lines = content.split('\n')
+        # Offsets de inicio de línea, calculados una vez y compartidos por los extractores
+        line_starts = self._line_offsets(lines)
         
         # Detectar módulo basado en la ruta
         module = self._extract_module_from_path(file_path)
@@ -231,9 +849,9 @@ class CodeAnalysisAgent:
         framework = self._detect_framework(content, language)
         
         if language in ['javascript', 'typescript']:
-            fragments.extend(self._extract_js_fragments(lines, file_path, module, language, framework))
+            fragments.extend(self._extract_js_fragments(lines, file_path, module, language, framework, content, line_starts))
         elif language == 'python':
-            fragments.extend(self._extract_python_fragments(lines, file_path, module, language, framework))
+            fragments.extend(self._extract_python_fragments(lines, file_path, module, language, framework, content, line_starts))
         elif language == 'html':
             fragments.extend(self._extract_html_fragments(lines, file_path, module, language, framework))
         elif language in ['css', 'scss', 'sass']:
@@ -241,9 +859,95 @@ class CodeAnalysisAgent:
         else:
             # Fragmentación genérica
             fragments.extend(self._extract_generic_fragments(lines, file_path, module, language, framework))
-        
+
+        for fragment in fragments:
+            fragment['file_name'] = file_name
         return fragments
 
+    def _describe_fragments(self, fragments: List[Dict]):
+        """
+        Completa con Ollama las descripciones que la extracción dejó pendientes,
+        agrupando hasta description_batch_size fragmentos por consulta.
+        """
+        pending = []
+        for fragment in fragments:
+            if fragment.get('description') is not None:
+                continue
+            if fragment.get('parent_function'):
+                pending.append((fragment, 'function_chunk', f"{fragment['function_name']}_part_{fragment['fragment_index']}"))
+            else:
+                pending.append((fragment, fragment['type'], fragment['function_name']))
+        
+        batch_size = max(1, self.description_batch_size)
+        for i in range(0, len(pending), batch_size):
+            self._describe_fragment_batch(pending[i:i + batch_size])
+
+    def _describe_fragment_batch(self, batch: List[Tuple[Dict, str, str]]):
+        """Describe varios fragmentos con una sola consulta; los que no vengan en la respuesta usan un resumen heurístico"""
+        if len(batch) == 1:
+            fragment, fragment_type, name = batch[0]
+            fragment['description'] = self._generate_fragment_description(fragment['content'], fragment_type, name)
+            return
+        
+        sections = "\n\n".join(
+            f"[{number}] {fragment_type} '{name}':\n{fragment['content'][:500]}..."
+            for number, (fragment, fragment_type, name) in enumerate(batch, 1)
+        )
+        prompt = f"""Analiza estos {len(batch)} fragmentos de código y describe en 1-2 líneas qué hace cada uno:
+
+{sections}
+
+Responde solo con una línea por fragmento con el formato "[número] descripción", sin explicaciones adicionales."""
+        
+        # Sin stop: las líneas "[n] ..." pueden venir separadas por líneas en blanco
+        options = {"num_predict": self.description_max_tokens * len(batch)} if self.description_max_tokens else None
+        response = self._consultar_ollama(prompt, options)
+        if response.startswith('[Error'):
+            # Se conserva el error para que el archivo no se guarde en la caché de fragmentos
+            descriptions = {number: response for number in range(1, len(batch) + 1)}
+        else:
+            descriptions = {int(m.group(1)): m.group(2) for m in _DESCRIPTION_LINE_RE.finditer(response)}
+        
+        for number, (fragment, fragment_type, name) in enumerate(batch, 1):
+            fragment['description'] = descriptions.get(number) or f"{fragment_type.title()} {name}"
+
+    def _fragment_cache_key(self, file_path: str, content: str, language: str) -> Optional[str]:
+        """Clave de caché: versión de extracción + configuración + ruta + contenido"""
+        if not self._fragment_cache_dir:
+            return None
+        digest = hashlib.sha256()
+        digest.update(f"{FRAGMENT_CACHE_VERSION}|{language}|{self.max_function_lines}|{self.fragment_chunk_size}|"
+                      f"{self.fragment_overlap}|{file_path}|".encode('utf-8'))
+        digest.update(content.encode('utf-8', errors='ignore'))
+        return digest.hexdigest()
+
+    def _load_cached_fragments(self, cache_key: Optional[str]) -> Optional[List[Dict]]:
+        """Lee fragmentos de la caché en disco (None si no hay entrada válida)"""
+        if not cache_key:
+            return None
+        cache_file = self._fragment_cache_dir / f"{cache_key}.json"
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store_cached_fragments(self, cache_key: Optional[str], fragments: List[Dict]):
+        """Guarda fragmentos en la caché (no guarda si alguna descripción falló al consultar Ollama)"""
+        if not cache_key:
+            return
+        if any(str(f.get('description', '')).startswith('[Error') for f in fragments):
+            return
+        cache_file = self._fragment_cache_dir / f"{cache_key}.json"
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{threading.get_ident()}.tmp")
+        try:
+            self._fragment_cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(fragments, f, ensure_ascii=False)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            self._log(f"⚠️  No se pudo escribir la caché de fragmentos: {e}")
+
     def _extract_module_from_path(self, file_path: str) -> str:
         """Extrae el módulo basado en la estructura de carpetas"""
         path_parts = Path(file_path).parts
@@ -291,17 +995,44 @@ class CodeAnalysisAgent:
         
         return 'vanilla'
 
-    def _extract_js_fragments(self, lines: List[str], file_path: str, module: str, language: str, framework: str) -> List[Dict]:
-        """Extrae fragmentos específicos de JavaScript/TypeScript"""
+    def _extract_js_fragments(self, lines: List[str], file_path: str, module: str, language: str, framework: str,
+                              content: Optional[str] = None, line_starts: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Extrae fragmentos específicos de JavaScript/TypeScript.
+        Las líneas candidatas se localizan con un único regex sobre todo el
+        contenido; solo esas pasan por los detectores de cada tipo.
+        """
         fragments = []
+        if content is None:
+            content = '\n'.join(lines)
+        if line_starts is None:
+            line_starts = self._line_offsets(lines)
         i = 0
+        # Un solo finditer sobre el archivo (con re2, search(content, pos) por línea volvería
+        # a codificar el archivo completo en cada llamada)
+        matches = _JS_CANDIDATE_RE.finditer(content)
+        match = None
         
         while i < len(lines):
+            pos = line_starts[i]
+            # Primer candidato que empieza en la línea i o después
+            while match is None or match.start() < pos:
+                if match is not None and match.end() > pos:
+                    # El match anterior cruza hasta la línea i y puede tapar un inicio posterior:
+                    # reanudar la búsqueda desde pos (poco frecuente)
+                    matches = _JS_CANDIDATE_RE.finditer(content, pos)
+                match = next(matches, None)
+                if match is None:
+                    break
+            if match is None:
+                break
+            i = bisect_right(line_starts, match.start()) - 1
             line = lines[i].strip()
             
             # Funciones
             if self._is_function_declaration(line):
-                fragment = self._extract_function_fragment(lines, i, file_path, module, language, framework)
+                fragment = self._extract_function_fragment(lines, i, file_path, module, language, framework,
+                                                           file_content=content, line_starts=line_starts)
                 if fragment:
                     fragments.append(fragment)
                     i = fragment['end_line']
@@ -341,64 +1072,39 @@ class CodeAnalysisAgent:
         
         return fragments
 
+    def _line_offsets(self, lines: List[str]) -> List[int]:
+        """
+        Desplazamiento en el contenido donde empieza cada línea, más un centinela final
+        (len(content) + 1): las líneas a..b son content[offsets[a]:offsets[b + 1] - 1].
+        """
+        return list(accumulate((len(line) + 1 for line in lines), initial=0))
+
+    def _slice_lines(self, lines: List[str], start_idx: int, end_idx: int,
+                     file_content: Optional[str] = None, line_starts: Optional[List[int]] = None) -> str:
+        """Texto de las líneas start_idx..end_idx: corte del contenido original si se conocen los offsets"""
+        if file_content is None or line_starts is None:
+            return '\n'.join(lines[start_idx:end_idx + 1])
+        return file_content[line_starts[start_idx]:line_starts[end_idx + 1] - 1]
+
     def _is_function_declaration(self, line: str) -> bool:
         """Detecta declaraciones de función"""
-        patterns = [
-            r'function\s+\w+',
-            r'const\s+\w+\s*=\s*\(',
-            r'let\s+\w+\s*=\s*\(',
-            r'var\s+\w+\s*=\s*\(',
-            r'\w+\s*:\s*function',
-            r'\w+\s*=>\s*{',
-            r'async\s+function',
-            r'export\s+function',
-            r'export\s+const\s+\w+\s*='
-        ]
-        return any(re.search(pattern, line) for pattern in patterns)
+        return any(pattern.search(line) for pattern in _JS_FUNCTION_PATTERNS)
 
     def _is_class_declaration(self, line: str) -> bool:
         """Detecta declaraciones de clase"""
-        patterns = [
-            r'class\s+\w+',
-            r'export\s+class\s+\w+',
-            r'export\s+default\s+class\s+\w+'
-        ]
-        return any(re.search(pattern, line) for pattern in patterns)
+        return any(pattern.search(line) for pattern in _JS_CLASS_PATTERNS)
 
     def _is_component_declaration(self, line: str, framework: str) -> bool:
         """Detecta declaraciones de componente según el framework"""
-        if framework == 'react':
-            patterns = [
-                r'const\s+\w+\s*=\s*\(\s*\)\s*=>\s*{',
-                r'function\s+\w+\s*\(\s*\)\s*{.*return.*<',
-                r'export\s+default\s+function\s+\w+'
-            ]
-        elif framework == 'vue':
-            patterns = [
-                r'export\s+default\s*{',
-                r'Vue\.component\s*\(',
-                r'<script.*setup'
-            ]
-        elif framework == 'polymer':
-            patterns = [
-                r'Polymer\s*\(',
-                r'class\s+\w+\s+extends\s+PolymerElement'
-            ]
-        else:
+        patterns = _COMPONENT_PATTERNS.get(framework)
+        if not patterns:
             return False
         
-        return any(re.search(pattern, line) for pattern in patterns)
+        return any(pattern.search(line) for pattern in patterns)
 
     def _is_endpoint_declaration(self, line: str) -> bool:
         """Detecta declaraciones de endpoint"""
-        patterns = [
-            r'app\.(get|post|put|delete|patch)\s*\(',
-            r'router\.(get|post|put|delete|patch)\s*\(',
-            r'@(Get|Post|Put|Delete|Patch)\s*\(',
-            r'@app\.route\s*\(',
-            r'def\s+\w+.*@.*route'
-        ]
-        return any(re.search(pattern, line, re.IGNORECASE) for pattern in patterns)
+        return any(pattern.search(line) for pattern in _ENDPOINT_PATTERNS)
 
     def _is_important_import_export(self, line: str) -> bool:
         """Detecta imports/exports importantes"""
@@ -408,30 +1114,31 @@ class CodeAnalysisAgent:
             return not any(lib in line.lower() for lib in common_libs)
         return False
 
-    def _extract_function_fragment(self, lines: List[str], start_idx: int, file_path: str, module: str, language: str, framework: str) -> Dict:
+    def _extract_function_fragment(self, lines: List[str], start_idx: int, file_path: str, module: str, language: str, framework: str,
+                                   file_content: Optional[str] = None, line_starts: Optional[List[int]] = None) -> Dict:
         """Extrae un fragmento de función completo"""
         start_line = start_idx + 1  # 1-indexed
         function_name = self._extract_function_name(lines[start_idx])
+        if file_content is None:
+            file_content = '\n'.join(lines)
+        if line_starts is None:
+            line_starts = self._line_offsets(lines)
         
         # Encontrar el final de la función
-        end_idx = self._find_function_end(lines, start_idx)
+        end_idx = self._find_function_end(lines, start_idx, file_content, line_starts)
         end_line = end_idx + 1
         
-        # Extraer contenido
-        content_lines = lines[start_idx:end_idx + 1]
-        content = '\n'.join(content_lines)
-        
         # Si la función es muy larga, fragmentarla
-        if len(content_lines) > self.max_function_lines:
+        if end_idx - start_idx + 1 > self.max_function_lines:
             # Para funciones largas, devolver el primer fragmento y agregar los demás a la lista
-            large_fragments = self._fragment_large_function(content_lines, start_line, function_name, file_path, module, language, framework)
+            large_fragments = self._fragment_large_function(lines[start_idx:end_idx + 1], start_line, function_name, file_path, module, language, framework)
             return large_fragments[0] if large_fragments else None
         
-        # Generar descripción
-        description = self._generate_fragment_description(content, 'function', function_name)
+        # Extraer contenido: corte directo del archivo, sin volver a unir las líneas
+        content = file_content[line_starts[start_idx]:line_starts[end_idx + 1] - 1]
         
         return {
-            'file_name': os.path.basename(file_path),
+            'file_name': None,  # se completa en _parse_code_fragments
             'file_path': file_path,
             'type': 'function',
             'function_name': function_name,
@@ -440,7 +1147,7 @@ class CodeAnalysisAgent:
             'start_line': start_line,
             'end_line': end_line,
             'content': content,
-            'description': description,
+            'description': None,  # se completa en _describe_fragments
             'module': module,
             'language': language,
             'framework': framework,
@@ -450,48 +1157,43 @@ class CodeAnalysisAgent:
             'return_type': self._extract_return_type(content)
         }
 
-    def _find_function_end(self, lines: List[str], start_idx: int) -> int:
-        """Encuentra el final de una función basado en llaves/indentación"""
-        brace_count = 0
-        in_function = False
-        
-        for i in range(start_idx, len(lines)):
-            line = lines[i]
-            
-            # Contar llaves
-            brace_count += line.count('{') - line.count('}')
-            
-            if '{' in line:
-                in_function = True
-            
-            # Si estamos en la función y las llaves se balancean, hemos terminado
-            if in_function and brace_count == 0:
-                return i
-        
-        # Si no encontramos el final, devolver hasta el final del archivo
-        return len(lines) - 1
+    def _find_function_end(self, lines: List[str], start_idx: int, content: Optional[str] = None,
+                           line_starts: Optional[List[int]] = None) -> int:
+        """Encuentra la línea donde se cierra la primera llave abierta desde start_idx"""
+        if content is None:
+            content = '\n'.join(lines)
+        if line_starts is None:
+            line_starts = self._line_offsets(lines)
+        
+        end_offset = self._scan_braces(content, line_starts[start_idx])
+        if end_offset < 0:
+            # Si no encontramos el final, devolver hasta el final del archivo
+            return len(lines) - 1
+        return bisect_right(line_starts, end_offset) - 1
+
+    def _scan_braces(self, content: str, start_char_idx: int) -> int:
+        """
+        Devuelve el desplazamiento de la llave que cierra la primera '{' encontrada
+        desde start_char_idx, o -1 si no se cierra. Las llaves dentro de comentarios,
+        cadenas, template literals y regex literales no cuentan.
+        """
+        depth = 0
+        for token in _JS_BRACE_TOKEN_RE.finditer(content, start_char_idx):
+            brace = token.group()
+            if brace == '{':
+                depth += 1
+            elif brace == '}' and depth:
+                depth -= 1
+                if depth == 0:
+                    return token.start()
+        return -1
 
     def _extract_function_name(self, line: str) -> str:
         """Extrae el nombre de la función de la línea de declaración"""
-        # function nombre()
-        match = re.search(r'function\s+(\w+)', line)
-        if match:
-            return match.group(1)
-        
-        # const nombre = () =>
-        match = re.search(r'(?:const|let|var)\s+(\w+)\s*=', line)
-        if match:
-            return match.group(1)
-        
-        # nombre: function()
-        match = re.search(r'(\w+)\s*:\s*function', line)
-        if match:
-            return match.group(1)
-        
-        # export function nombre()
-        match = re.search(r'export\s+function\s+(\w+)', line)
-        if match:
-            return match.group(1)
+        for pattern in _JS_FUNCTION_NAME_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                return match.group(1)
         
         return 'anonymous'
 
@@ -503,17 +1205,21 @@ class CodeAnalysisAgent:
 
 Responde solo con la descripción, sin explicaciones adicionales."""
         
-        return self._consultar_ollama(prompt) or f"{fragment_type.title()} {name}"
+        # Una descripción de 1-2 líneas: Ollama corta al llegar al límite o a una línea en blanco
+        options = {"stop": ["\n\n"]}
+        if self.description_max_tokens:
+            options["num_predict"] = self.description_max_tokens
+        return self._consultar_ollama(prompt, options) or f"{fragment_type.title()} {name}"
 
     def _estimate_complexity(self, content: str) -> str:
         """Estima la complejidad del fragmento"""
-        lines = len(content.split('\n'))
+        lines = content.count('\n') + 1
         
         # Contar estructuras de control
-        control_structures = len(re.findall(r'\b(if|for|while|switch|try|catch)\b', content))
+        control_structures = len(_CONTROL_STRUCTURES_RE.findall(content))
         
         # Contar funciones anidadas
-        nested_functions = len(re.findall(r'function\s+\w+|=>\s*{', content))
+        nested_functions = len(_NESTED_FUNCTIONS_RE.findall(content))
         
         complexity_score = lines + (control_structures * 3) + (nested_functions * 2)
         
@@ -526,22 +1232,16 @@ Responde solo con la descripción, sin explicaciones adicionales."""
 
     def _extract_dependencies_from_content(self, content: str) -> List[str]:
         """Extrae dependencias del contenido del fragmento"""
-        dependencies = []
-        
-        # Imports
-        imports = re.findall(r'import.*?from\s+[\'"]([^\'"]+)[\'"]', content)
-        dependencies.extend(imports)
-        
-        # Requires
-        requires = re.findall(r'require\s*\(\s*[\'"]([^\'"]+)[\'"]\s*\)', content)
-        dependencies.extend(requires)
-        
-        return list(set(dependencies))
+        # Imports y requires; dict.fromkeys quita duplicados conservando el orden de aparición
+        # (resultado estable entre ejecuciones, a diferencia de set)
+        imports = _IMPORT_FROM_RE.findall(content)
+        requires = _REQUIRE_RE.findall(content)
+        return list(dict.fromkeys(imports + requires))
 
     def _extract_function_parameters(self, line: str) -> List[str]:
         """Extrae parámetros de la función"""
         # Buscar parámetros entre paréntesis
-        match = re.search(r'\(([^)]*)\)', line)
+        match = _PARAMETERS_RE.search(line)
         if match:
             params_str = match.group(1).strip()
             if params_str:
@@ -552,10 +1252,10 @@ Responde solo con la descripción, sin explicaciones adicionales."""
 
     def _extract_return_type(self, content: str) -> str:
         """Intenta detectar el tipo de retorno"""
-        # Buscar return statements
-        returns = re.findall(r'return\s+([^;]+)', content)
-        if returns:
-            first_return = returns[0].strip()
+        # Solo interesa el primer return
+        match = _JS_RETURN_RE.search(content)
+        if match:
+            first_return = match.group(1).strip()
             if first_return.startswith('{'):
                 return 'object'
             elif first_return.startswith('['):
@@ -589,25 +1289,102 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         # Implementar para imports/exports importantes
         return None
 
-    def _extract_python_fragments(self, lines: List[str], file_path: str, module: str, language: str, framework: str) -> List[Dict]:
-        """Extrae fragmentos de Python: funciones, clases, imports"""
+    def _extract_python_fragments(self, lines: List[str], file_path: str, module: str, language: str, framework: str,
+                                  content: Optional[str] = None, line_starts: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Extrae fragmentos de Python: funciones, clases, imports.
+        Usa el módulo ast (una sola pasada, con decoradores y firmas multilínea);
+        si el archivo no parsea (Python 2, plantillas, etc.) cae al escaneo por líneas.
+        """
+        if content is None:
+            content = '\n'.join(lines)
+        if line_starts is None:
+            line_starts = self._line_offsets(lines)
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            return self._extract_python_fragments_by_lines(lines, file_path, module, language, framework, content, line_starts)
+
+        fragments = []
+        for node in self._iter_python_definitions(tree.body):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                # Incluir decoradores en el fragmento
+                start_idx = min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+                end_idx = node.end_lineno - 1
+
+                if isinstance(node, ast.ClassDef):
+                    fragment = self._extract_python_class_fragment(lines, start_idx, file_path, module, language, framework,
+                                                                   end_idx=end_idx, name=node.name,
+                                                                   file_content=content, line_starts=line_starts)
+                    fragments.append(fragment)
+                elif end_idx - start_idx + 1 > self.max_function_lines:
+                    fragments.extend(self._fragment_large_function(lines[start_idx:end_idx + 1], start_idx + 1, node.name,
+                                                                   file_path, module, language, framework))
+                else:
+                    fragment = self._extract_python_function_fragment(lines, start_idx, file_path, module, language, framework,
+                                                                      end_idx=end_idx, name=node.name,
+                                                                      parameters=self._python_node_parameters(node),
+                                                                      file_content=content, line_starts=line_starts)
+                    fragments.append(fragment)
+
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                line_idx = node.lineno - 1
+                if self._is_python_important_import(lines[line_idx].strip()):
+                    fragments.append(self._extract_python_import_fragment(lines, line_idx, file_path, module, language, framework))
+
+        return fragments
+
+    def _iter_python_definitions(self, body: List[ast.stmt]):
+        """Recorre las sentencias de nivel superior, entrando en bloques if/try/with/for/while pero no en funciones ni clases"""
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Import, ast.ImportFrom)):
+                yield node
+                continue
+            for field in ('body', 'orelse', 'finalbody'):
+                yield from self._iter_python_definitions(getattr(node, field, None) or [])
+            for handler in getattr(node, 'handlers', None) or []:
+                yield from self._iter_python_definitions(handler.body)
+
+    def _python_node_parameters(self, node: ast.AST) -> List[str]:
+        """Parámetros de una función a partir de su nodo ast (sin self)"""
+        args = node.args
+        params = [a.arg for a in getattr(args, 'posonlyargs', []) + args.args]
+        if args.vararg:
+            params.append(f"*{args.vararg.arg}")
+        params.extend(a.arg for a in args.kwonlyargs)
+        if args.kwarg:
+            params.append(f"**{args.kwarg.arg}")
+        return [p for p in params if p != 'self']
+
+    def _extract_python_fragments_by_lines(self, lines: List[str], file_path: str, module: str, language: str, framework: str,
+                                           content: Optional[str] = None, line_starts: Optional[List[int]] = None) -> List[Dict]:
+        """Extrae fragmentos de Python escaneando línea por línea (para archivos que ast no puede parsear)"""
         fragments = []
+        indents = self._compute_indents(lines)
         i = 0
         
         while i < len(lines):
             line = lines[i].strip()
+            # Tipo, nombre y parámetros salen de un único match de la cabecera
+            kind, name, parameters = self._parse_python_header(line)
             
             # Funciones
-            if self._is_python_function_declaration(line):
-                fragment = self._extract_python_function_fragment(lines, i, file_path, module, language, framework)
+            if kind == 'function':
+                fragment = self._extract_python_function_fragment(lines, i, file_path, module, language, framework,
+                                                                  end_idx=self._find_python_function_end(lines, i, indents),
+                                                                  name=name, parameters=parameters,
+                                                                  file_content=content, line_starts=line_starts)
                 if fragment:
                     fragments.append(fragment)
                     i = fragment['end_line']
                     continue
             
             # Clases
-            elif self._is_python_class_declaration(line):
-                fragment = self._extract_python_class_fragment(lines, i, file_path, module, language, framework)
+            elif kind == 'class':
+                fragment = self._extract_python_class_fragment(lines, i, file_path, module, language, framework,
+                                                               end_idx=self._find_python_class_end(lines, i, indents),
+                                                               name=name,
+                                                               file_content=content, line_starts=line_starts)
                 if fragment:
                     fragments.append(fragment)
                     i = fragment['end_line']
@@ -623,46 +1400,60 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         
         return fragments
 
+    def _parse_python_header(self, line: str) -> Tuple[Optional[str], Optional[str], List[str]]:
+        """
+        Analiza la cabecera de una declaración Python con un solo regex.
+        Devuelve ('function' | 'class' | None, nombre, parámetros).
+        """
+        match = _PYTHON_HEADER_RE.match(line)
+        if not match:
+            return None, None, []
+        keyword, name, open_paren, params_str = match.groups()
+        if keyword == 'class':
+            return 'class', name, []
+        if open_paren is None:
+            return None, None, []
+        return 'function', name, self._split_python_parameters(params_str)
+
     def _is_python_function_declaration(self, line: str) -> bool:
         """Detecta declaraciones de función en Python"""
-        return re.match(r'^\s*def\s+\w+\s*\(', line) is not None
+        return _PYTHON_FUNCTION_DECL_RE.match(line) is not None
 
     def _is_python_class_declaration(self, line: str) -> bool:
         """Detecta declaraciones de clase en Python"""
-        return re.match(r'^\s*class\s+\w+', line) is not None
+        return _PYTHON_CLASS_DECL_RE.match(line) is not None
 
     def _is_python_important_import(self, line: str) -> bool:
         """Detecta imports importantes en Python"""
-        if line.startswith('import ') or line.startswith('from '):
+        if line.startswith(('import ', 'from ')):
             # Ignorar imports de librerías muy comunes
-            common_libs = ['os', 'sys', 'json', 're', 'time', 'datetime']
-            return not any(lib in line.lower() for lib in common_libs)
+            line_lower = line.lower()
+            return not any(lib in line_lower for lib in _COMMON_PYTHON_LIBS)
         return False
 
-    def _extract_python_function_fragment(self, lines: List[str], start_idx: int, file_path: str, module: str, language: str, framework: str) -> Dict:
-        """Extrae un fragmento de función Python"""
+    def _extract_python_function_fragment(self, lines: List[str], start_idx: int, file_path: str, module: str, language: str, framework: str,
+                                          end_idx: int = None, name: str = None, parameters: List[str] = None,
+                                          file_content: Optional[str] = None, line_starts: Optional[List[int]] = None) -> Dict:
+        """Extrae un fragmento de función Python (end_idx, name y parameters llegan ya resueltos desde ast)"""
         start_line = start_idx + 1  # 1-indexed
-        function_name = self._extract_python_function_name(lines[start_idx])
+        function_name = name or self._extract_python_function_name(lines[start_idx])
         
         # Encontrar el final de la función basado en indentación
-        end_idx = self._find_python_function_end(lines, start_idx)
+        if end_idx is None:
+            end_idx = self._find_python_function_end(lines, start_idx)
         end_line = end_idx + 1
         
-        # Extraer contenido
-        content_lines = lines[start_idx:end_idx + 1]
-        content = '\n'.join(content_lines)
-        
         # Si la función es muy larga, fragmentarla
-        if len(content_lines) > self.max_function_lines:
+        if end_idx - start_idx + 1 > self.max_function_lines:
             # Para funciones largas, devolver el primer fragmento y agregar los demás a la lista
-            large_fragments = self._fragment_large_function(content_lines, start_line, function_name, file_path, module, language, framework)
+            large_fragments = self._fragment_large_function(lines[start_idx:end_idx + 1], start_line, function_name, file_path, module, language, framework)
             return large_fragments[0] if large_fragments else None
         
-        # Generar descripción
-        description = self._generate_fragment_description(content, 'function', function_name)
+        # Extraer contenido: corte directo del archivo, sin volver a unir las líneas
+        content = self._slice_lines(lines, start_idx, end_idx, file_content, line_starts)
         
         return {
-            'file_name': os.path.basename(file_path),
+            'file_name': None,  # se completa en _parse_code_fragments
             'file_path': file_path,
             'type': 'function',
             'function_name': function_name,
@@ -671,34 +1462,33 @@ Responde solo con la descripción, sin explicaciones adicionales."""
             'start_line': start_line,
             'end_line': end_line,
             'content': content,
-            'description': description,
+            'description': None,  # se completa en _describe_fragments
             'module': module,
             'language': language,
             'framework': framework,
             'complexity': self._estimate_complexity(content),
             'dependencies': self._extract_dependencies_from_content(content),
-            'parameters': self._extract_python_function_parameters(lines[start_idx]),
+            'parameters': parameters if parameters is not None else self._extract_python_function_parameters(lines[start_idx]),
             'return_type': self._extract_python_return_type(content)
         }
 
-    def _extract_python_class_fragment(self, lines: List[str], start_idx: int, file_path: str, module: str, language: str, framework: str) -> Dict:
-        """Extrae un fragmento de clase Python"""
+    def _extract_python_class_fragment(self, lines: List[str], start_idx: int, file_path: str, module: str, language: str, framework: str,
+                                       end_idx: int = None, name: str = None,
+                                       file_content: Optional[str] = None, line_starts: Optional[List[int]] = None) -> Dict:
+        """Extrae un fragmento de clase Python (end_idx y name llegan ya resueltos desde ast)"""
         start_line = start_idx + 1  # 1-indexed
-        class_name = self._extract_python_class_name(lines[start_idx])
+        class_name = name or self._extract_python_class_name(lines[start_idx])
         
         # Encontrar el final de la clase basado en indentación
-        end_idx = self._find_python_class_end(lines, start_idx)
+        if end_idx is None:
+            end_idx = self._find_python_class_end(lines, start_idx)
         end_line = end_idx + 1
         
-        # Extraer contenido
-        content_lines = lines[start_idx:end_idx + 1]
-        content = '\n'.join(content_lines)
-        
-        # Generar descripción
-        description = self._generate_fragment_description(content, 'class', class_name)
+        # Extraer contenido: corte directo del archivo, sin volver a unir las líneas
+        content = self._slice_lines(lines, start_idx, end_idx, file_content, line_starts)
         
         return {
-            'file_name': os.path.basename(file_path),
+            'file_name': None,  # se completa en _parse_code_fragments
             'file_path': file_path,
             'type': 'class',
             'function_name': class_name,
@@ -707,7 +1497,7 @@ Responde solo con la descripción, sin explicaciones adicionales."""
             'start_line': start_line,
             'end_line': end_line,
             'content': content,
-            'description': description,
+            'description': None,  # se completa en _describe_fragments
             'module': module,
             'language': language,
             'framework': framework,
@@ -722,7 +1512,7 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         line = lines[start_idx]
         
         return {
-            'file_name': os.path.basename(file_path),
+            'file_name': None,  # se completa en _parse_code_fragments
             'file_path': file_path,
             'type': 'import',
             'function_name': 'imports',
@@ -741,73 +1531,85 @@ Responde solo con la descripción, sin explicaciones adicionales."""
             'return_type': 'import'
         }
 
-    def _find_python_function_end(self, lines: List[str], start_idx: int) -> int:
+    def _compute_indents(self, lines: List[str]) -> List[int]:
+        """Indentación de cada línea, calculada una vez por archivo (-1 en líneas vacías o solo comentario)"""
+        indents = []
+        for line in lines:
+            stripped = line.lstrip()
+            if not stripped or stripped.startswith('#'):
+                indents.append(-1)
+            else:
+                indents.append(len(line) - len(stripped))
+        return indents
+
+    def _find_python_function_end(self, lines: List[str], start_idx: int, indents: Optional[List[int]] = None) -> int:
         """Encuentra el final de una función Python basado en indentación"""
         if start_idx >= len(lines):
             return start_idx
+        if indents is None:
+            indents = self._compute_indents(lines)
         
         # Obtener la indentación base de la función
         base_indent = len(lines[start_idx]) - len(lines[start_idx].lstrip())
         
-        # Buscar el final basado en indentación
+        # La primera línea con indentación igual o menor (ignorando vacías y comentarios) cierra la función
         for i in range(start_idx + 1, len(lines)):
-            line = lines[i]
-            
-            # Líneas vacías o solo comentarios se ignoran
-            if not line.strip() or line.strip().startswith('#'):
-                continue
-            
-            # Si encontramos una línea con indentación igual o menor, hemos terminado
-            current_indent = len(line) - len(line.lstrip())
-            if current_indent <= base_indent:
+            if 0 <= indents[i] <= base_indent:
                 return i - 1
         
         # Si llegamos al final del archivo
         return len(lines) - 1
 
-    def _find_python_class_end(self, lines: List[str], start_idx: int) -> int:
+    def _find_python_class_end(self, lines: List[str], start_idx: int, indents: Optional[List[int]] = None) -> int:
         """Encuentra el final de una clase Python basado en indentación"""
-        return self._find_python_function_end(lines, start_idx)
+        return self._find_python_function_end(lines, start_idx, indents)
 
     def _extract_python_function_name(self, line: str) -> str:
         """Extrae el nombre de la función de la línea de declaración Python"""
-        match = re.search(r'def\s+(\w+)', line)
+        match = _PYTHON_DEF_NAME_RE.search(line)
         return match.group(1) if match else 'unknown_function'
 
     def _extract_python_class_name(self, line: str) -> str:
         """Extrae el nombre de la clase de la línea de declaración Python"""
-        match = re.search(r'class\s+(\w+)', line)
+        match = _PYTHON_CLASS_NAME_RE.search(line)
         return match.group(1) if match else 'unknown_class'
 
     def _extract_python_function_parameters(self, line: str) -> List[str]:
         """Extrae parámetros de la función Python"""
-        match = re.search(r'def\s+\w+\s*\(([^)]*)\)', line)
-        if match:
-            params_str = match.group(1).strip()
-            if params_str:
-                # Dividir por comas y limpiar
-                params = [p.strip().split('=')[0].strip().split(':')[0].strip() for p in params_str.split(',')]
-                return [p for p in params if p and p != 'self']
+        match = _PYTHON_PARAMS_RE.search(line)
+        return self._split_python_parameters(match.group(1)) if match else []
+
+    def _split_python_parameters(self, params_str: Optional[str]) -> List[str]:
+        """Nombres de los parámetros de una firma Python (sin self, defaults ni anotaciones)"""
+        params_str = (params_str or '').strip()
+        if params_str:
+            # Dividir por comas y limpiar
+            params = [p.strip().split('=')[0].strip().split(':')[0].strip() for p in params_str.split(',')]
+            return [p for p in params if p and p != 'self']
         return []
 
     def _extract_python_return_type(self, content: str) -> str:
-        """Intenta detectar el tipo de retorno en Python"""
-        # Buscar return statements
-        returns = re.findall(r'return\s+([^#\n]+)', content)
-        if returns:
-            first_return = returns[0].strip()
+        """Intenta detectar el tipo de retorno en Python a partir del primer return con valor"""
+        for line in content.splitlines():
+            stripped = line.lstrip()
+            if not stripped.startswith(('return ', 'return\t')):
+                continue
+            first_return = stripped[7:].split('#', 1)[0].strip()
+            if not first_return:
+                continue
             if first_return.startswith('{') or 'dict(' in first_return:
                 return 'dict'
             elif first_return.startswith('[') or 'list(' in first_return:
                 return 'list'
-            elif first_return.startswith('"') or first_return.startswith("'"):
+            elif first_return.startswith(('"', "'")):
                 return 'str'
             elif first_return.isdigit():
                 return 'int'
-            elif first_return in ['True', 'False']:
+            elif first_return in ('True', 'False'):
                 return 'bool'
             elif first_return == 'None':
                 return 'None'
+            return 'unknown'
         return 'unknown'
 
     def _extract_html_fragments(self, lines: List[str], file_path: str, module: str, language: str, framework: str) -> List[Dict]:
@@ -833,10 +1635,8 @@ Responde solo con la descripción, sin explicaciones adicionales."""
             chunk_start_line = start_line + i
             chunk_end_line = start_line + end_idx - 1
             
-            description = self._generate_fragment_description(chunk_content, 'function_chunk', f"{function_name}_part_{len(fragments)}")
-            
             fragment = {
-                'file_name': os.path.basename(file_path),
+                'file_name': None,  # se completa en _parse_code_fragments
                 'file_path': file_path,
                 'type': 'function',
                 'function_name': function_name,
@@ -845,7 +1645,7 @@ Responde solo con la descripción, sin explicaciones adicionales."""
                 'start_line': chunk_start_line,
                 'end_line': chunk_end_line,
                 'content': chunk_content,
-                'description': description,
+                'description': None,  # se completa en _describe_fragments
                 'module': module,
                 'language': language,
                 'framework': framework,
@@ -861,17 +1661,14 @@ Responde solo con la descripción, sin explicaciones adicionales."""
 
     def _detect_language(self, file_path: str) -> str:
         """Detecta el lenguaje basado en la extensión"""
-        ext = Path(file_path).suffix.lower()
-        lang_map = {
-            '.js': 'javascript', '.ts': 'typescript', '.jsx': 'javascript', '.tsx': 'typescript',
-            '.html': 'html', '.htm': 'html', '.css': 'css', '.scss': 'scss', '.sass': 'sass',
-            '.py': 'python', '.java': 'java', '.cs': 'csharp', '.php': 'php', '.rb': 'ruby',
-            '.go': 'go', '.rs': 'rust', '.cpp': 'cpp', '.c': 'c', '.vue': 'vue'
-        }
-        return lang_map.get(ext, 'unknown')
+        return _LANGUAGE_BY_EXT.get(os.path.splitext(file_path)[1].lower(), 'unknown')
 
-    def _process_file_thread_safe(self, file_data: tuple, project_name: str, project_analysis: Dict, file_index: int, total_files: int) -> Dict:
-        """Procesa un archivo en un thread separado de forma segura"""
+    def _extract_file_stage(self, file_data: tuple, file_index: int, total_files: int,
+                            indexing_queue: queue.Queue, done_queue: queue.Queue):
+        """
+        Etapa 1 (pool de extracción): fragmenta el archivo y deja los fragmentos en la cola de indexación.
+        Los archivos que no llegan a indexarse publican su resultado directamente en done_queue.
+        """
         file_path, relative_path = file_data
         result = {
             "success": False,
@@ -882,68 +1679,112 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         }
         
         try:
-            # Leer archivo
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-            except Exception as e:
-                reason = f"Error leyendo archivo: {relative_path} - {e}"
-                self._log(f"⚠️  No se pudo leer: {relative_path}")
+            fragments = self._extract_fragments_for_file(file_path, relative_path, result, file_index, total_files)
+            if fragments:
+                # Bloquea si la cola está llena: la extracción no se adelanta a la indexación
+                indexing_queue.put((relative_path, fragments, result))
+                return
+            
+            if fragments is not None:
+                reason = f"No se encontraron fragmentos relevantes: {relative_path}"
+                self._log(f"⚠️  Sin fragmentos: {relative_path}")
                 self._log_to_file("not_indexed", reason)
                 result["error"] = reason
-                return result
-            
-            # Verificar si debe indexar
-            if not self._should_index_file(file_path, relative_path, content):
-                result["success"] = True
-                return result
-            
-            self._log(f"🔍 Analizando archivo: {relative_path} ({file_index}/{total_files})")
-            
-            # Detectar lenguaje
-            language = self._detect_language(file_path)
-            
-            # Extraer fragmentos
-            fragments = self._extract_code_fragments(file_path, content, language)
-            
-            if fragments:
-                # Indexar cada fragmento
-                indexed_count = 0
-                for fragment in fragments:
-                    if self._index_fragment(fragment, project_name):
-                        indexed_count += 1
                 
-                with self._counter_lock:
-                    self._indexed_fragments_count += indexed_count
+        except Exception as e:
+            error_msg = f"❌ Error en: {relative_path} - {e}"
+            reason = f"Error durante indexación: {relative_path} - {e}"
+            self._log(error_msg)
+            self._log_to_file("not_indexed", reason)
+            result["error"] = reason
+        
+        done_queue.put(result)
+
+    def _index_file_stage(self, project_name: str, indexing_queue: queue.Queue, done_queue: queue.Queue):
+        """Etapa 2 (threads de indexación): consume los fragmentos de la cola hasta recibir None"""
+        while True:
+            item = indexing_queue.get()
+            if item is None:
+                return
+            
+            relative_path, fragments, result = item
+            try:
+                indexed_count = self._index_fragments_for_file(fragments, project_name)
                 
                 self._log(f"✅ Indexado: {relative_path} ({indexed_count} fragmentos)")
                 result["success"] = True
                 result["indexed"] = True
                 result["fragments_count"] = indexed_count
-            else:
-                reason = f"No se encontraron fragmentos relevantes: {relative_path}"
-                self._log(f"⚠️  Sin fragmentos: {relative_path}")
+            except Exception as e:
+                error_msg = f"❌ Error en: {relative_path} - {e}"
+                reason = f"Error durante indexación: {relative_path} - {e}"
+                self._log(error_msg)
                 self._log_to_file("not_indexed", reason)
                 result["error"] = reason
-                
+            
+            done_queue.put(result)
+
+    def _extract_fragments_for_file(self, file_path: str, relative_path: str, result: Dict,
+                                    file_index: int, total_files: int) -> Optional[List[Dict]]:
+        """
+        Fase de extracción de un archivo: lectura, filtro y fragmentos (el análisis va al pool de procesos).
+        Devuelve None si el archivo se descarta o no se puede leer (el motivo queda en result).
+        """
+        try:
+            # Leer solo el inicio del archivo para decidir si se indexa
+            with open(file_path, 'rb') as f:
+                head = f.read(FILE_HEAD_BYTES)
+                file_size = os.fstat(f.fileno()).st_size
+            
+            if not self._should_index_file(file_path, relative_path, head, file_size):
+                result["success"] = True
+                return None
+            
+            # Leer el archivo completo solo si se va a indexar
+            content = self._read_source_file(file_path, file_size)
         except Exception as e:
-            error_msg = f"❌ Error en: {relative_path} - {e}"
-            reason = f"Error durante indexación: {relative_path} - {e}"
-            self._log(error_msg)
+            reason = f"Error leyendo archivo: {relative_path} - {e}"
+            self._log(f"⚠️  No se pudo leer: {relative_path}")
             self._log_to_file("not_indexed", reason)
             result["error"] = reason
+            return None
         
-        return result
+        self._log(f"🔍 Analizando archivo: {relative_path} ({file_index}/{total_files})")
+        
+        language = self._detect_language(file_path)
+        return self._extract_code_fragments(file_path, content, language)
 
-    def _index_fragment(self, fragment: Dict, project_name: str) -> bool:
-        """Indexa un fragmento individual en Weaviate"""
+    def _index_fragments_for_file(self, fragments: List[Dict], project_name: str) -> int:
+        """Fase de indexación de un archivo (E/S): embeddings por lote y envío al lote de Weaviate"""
+        embeddings = self._get_embeddings_batch([self._embedding_text(f) for f in fragments])
+        
+        indexed_count = 0
+        # La clase de Weaviate y la fecha de indexación son las mismas para todos los fragmentos:
+        # se resuelven una vez por archivo
         class_name = f"CodeFragments_{self._sanitize_project_name(project_name)}"
+        indexed_at = datetime.now(timezone.utc).isoformat()
+        for fragment, embedding in zip(fragments, embeddings):
+            if self._index_fragment(fragment, project_name, embedding, class_name, indexed_at):
+                indexed_count += 1
+        return indexed_count
+
+    def _embedding_text(self, fragment: Dict) -> str:
+        """Texto usado para el embedding de un fragmento: descripción + inicio del contenido"""
+        return f"{fragment['description']} {fragment['content'][:500]}"
+
+    def _index_fragment(self, fragment: Dict, project_name: str, embedding: Optional[List[float]] = None,
+                        class_name: Optional[str] = None, indexed_at: Optional[str] = None) -> bool:
+        """Indexa un fragmento individual en Weaviate (usa el embedding, la clase y la fecha dados si ya se calcularon)"""
+        if class_name is None:
+            class_name = f"CodeFragments_{self._sanitize_project_name(project_name)}"
+        if indexed_at is None:
+            indexed_at = datetime.now(timezone.utc).isoformat()
         
         # Preparar datos para Weaviate
         weaviate_data = {
             "projectName": project_name,
             "fileName": fragment['file_name'],
-            "filePath": fragment['file_path'].replace('\\', '/'),
+            "filePath": fragment['file_path'],  # ya normalizada en _parse_code_fragments
             "type": fragment['type'],
             "functionName": fragment['function_name'],
             "parentFunction": fragment.get('parent_function'),
@@ -960,24 +1801,44 @@ Responde solo con la descripción, sin explicaciones adicionales."""
             "exports": fragment.get('exports', []),
             "parameters": fragment.get('parameters', []),
             "returnType": fragment.get('return_type', 'unknown'),
-            "indexedAt": datetime.now(timezone.utc).isoformat()
+            "indexedAt": indexed_at
         }
         
         # Crear embedding del contenido + descripción
-        embedding_text = f"{fragment['description']} {fragment['content'][:500]}"
-        embedding = self._get_embedding(embedding_text)
+        if embedding is None:
+            embedding = self._get_embedding(self._embedding_text(fragment))
+        embedding = self._compact_vector(embedding)
+        
+        # UUID determinista: re-indexar reemplaza el objeto en lugar de duplicarlo
+        object_uuid = uuid.uuid5(
+            FRAGMENT_UUID_NAMESPACE,
+            f"{project_name}:{weaviate_data['filePath']}:{fragment['start_line']}:{fragment['end_line']}:{fragment['fragment_index']}"
+        )
         
         try:
-            self.weaviate_client.data_object.create(
-                data_object=weaviate_data,
-                class_name=class_name,
-                vector=embedding
-            )
+            # El lote se envía solo al llenarse; los errores por objeto llegan a _on_batch_results
+            with self._batch_lock:
+                self.weaviate_client.batch.add_data_object(
+                    data_object=weaviate_data,
+                    class_name=class_name,
+                    uuid=str(object_uuid),
+                    vector=embedding
+                )
             return True
         except Exception as e:
             print(f"Error indexando fragmento {fragment['function_name']}: {e}")
             return False
 
+    def _compact_vector(self, vector: List[float]) -> List[float]:
+        """
+        Recorta el vector a vector_precision cifras significativas (precisión similar a float16).
+        El JSON enviado a Weaviate pasa de ~18 a ~7 caracteres por componente sin afectar la búsqueda.
+        """
+        if not vector or not self.vector_precision:
+            return vector
+        fmt = f".{self.vector_precision}g"
+        return [float(format(x, fmt)) for x in vector]
+
     def analyze_and_index_project(self, project_path: str, project_name: str = None, force_schema: bool = True) -> Dict:
         """Analiza e indexa un proyecto completo extrayendo fragmentos de código"""
         if project_name is None:
@@ -986,8 +1847,15 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         self._log(f"🚀 Iniciando análisis e indexación de fragmentos del proyecto: {project_name}", force=True)
         self._log(f"📁 Ruta: {project_path}", force=True)
         
+        if self.weaviate_client:
+            try:
+                self._ensure_weaviate_batch()
+            except Exception as e:
+                return {"error": f"No se pudo configurar la importación por lotes de Weaviate: {e}"}
+        
         if force_schema:
             if not self.create_weaviate_schema(project_name):
+                self._notify_project_data_changed(project_name)
                 return {"error": "No se pudo crear el esquema en Weaviate"}
         
         # Análisis básico del proyecto
@@ -995,64 +1863,50 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         project_analysis["project_name"] = project_name
         project_analysis["analysis_date"] = datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
         
-        # Resetear contador
-        with self._counter_lock:
-            self._indexed_fragments_count = 0
+        # Resetear contadores
+        self._indexed_fragments_count = 0
+        self._batch_errors = []
         
         errors = []
         start_time = time.time()
-        ignore_dirs = ['node_modules', 'bower_components', '.git', 'dist', 'build', 'coverage', 'nbproject']
-        all_files = []
         
-        # Recopilar todos los archivos
-        for root, dirs, files in os.walk(project_path):
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ignore_dirs]
-            for file in files:
-                if file.startswith('.'):
-                    continue
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, project_path).replace('\\', '/')
-                all_files.append((file_path, relative_path))
+        # Recopilar los archivos de código (las carpetas ignoradas no se recorren)
+        all_files = list(self._iter_source_files(project_path))
         
         total_files = len(all_files)
-        self._log(f"📁 Total de archivos encontrados: {total_files}", force=True)
+        self._log(f"📁 Total de archivos de código encontrados: {total_files}", force=True)
         
         # Configurar paralelización
         max_workers = self.max_workers
-        self._log(f"🚀 Procesando con {max_workers} threads paralelos", force=True)
+        self._log(f"🚀 Procesando con {max_workers} threads de extracción y {self.index_workers} de indexación", force=True)
         
-        completed_files = 0
         last_progress_time = time.time()
         
+        # Pipeline en dos etapas: la cola acotada frena la extracción si la indexación
+        # (Ollama/Weaviate) se atrasa, en lugar de acumular fragmentos en memoria
+        indexing_queue = queue.Queue(maxsize=4 * max_workers)
+        done_queue = queue.Queue()
+        indexers = [
+            threading.Thread(target=self._index_file_stage, args=(project_name, indexing_queue, done_queue), daemon=True)
+            for _ in range(self.index_workers)
+        ]
+        for indexer in indexers:
+            indexer.start()
+        
+        self._start_extraction_pool()
         try:
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # Enviar tareas al pool
-                future_to_file = {
-                    executor.submit(
-                        self._process_file_thread_safe, 
-                        file_data, 
-                        project_name, 
-                        project_analysis, 
-                        idx, 
-                        total_files
-                    ): (idx, file_data) for idx, file_data in enumerate(all_files, 1)
-                }
+                # Enviar tareas al pool de extracción
+                for idx, file_data in enumerate(all_files, 1):
+                    executor.submit(self._extract_file_stage, file_data, idx, total_files, indexing_queue, done_queue)
                 
-                # Procesar resultados conforme se completan
-                for future in as_completed(future_to_file):
-                    idx, file_data = future_to_file[future]
-                    completed_files += 1
+                # Procesar resultados conforme se completan (cada archivo publica uno, en la etapa que termina)
+                for completed_files in range(1, total_files + 1):
+                    result = done_queue.get()
+                    self._indexed_fragments_count += result["fragments_count"]
                     
-                    try:
-                        result = future.result(timeout=self.file_timeout)
-                        
-                        if result["error"]:
-                            errors.append(result["error"])
-                            
-                    except Exception as e:
-                        error_msg = f"❌ Error procesando {file_data[1]}: {e}"
-                        self._log(error_msg)
-                        errors.append(error_msg)
+                    if result["error"]:
+                        errors.append(result["error"])
                     
                     # Mostrar progreso cada 10 archivos o cada 30 segundos
                     current_time = time.time()
@@ -1064,20 +1918,29 @@ Responde solo con la descripción, sin explicaciones adicionales."""
                             est_seconds = int(avg_time * remaining)
                             est_min, est_sec = divmod(est_seconds, 60)
                             
-                            with self._counter_lock:
-                                indexed_count = self._indexed_fragments_count
-                            
-                            self._log(f"⏳ Progreso: {completed_files}/{total_files} procesados, {indexed_count} fragmentos indexados. Tiempo estimado: {est_min}m {est_sec}s", force=True)
+                            self._log(f"⏳ Progreso: {completed_files}/{total_files} procesados, {self._indexed_fragments_count} fragmentos indexados. Tiempo estimado: {est_min}m {est_sec}s", force=True)
                         last_progress_time = current_time
+            
+            # Todos los archivos terminaron: detener los threads de indexación
+            for _ in indexers:
+                indexing_queue.put(None)
+            for indexer in indexers:
+                indexer.join()
                         
         except KeyboardInterrupt:
             self._log("⏹️  Interrupción del usuario. Cerrando threads...", force=True)
             executor.shutdown(wait=False)
             raise
+        finally:
+            self._stop_extraction_pool()
         
-        # Obtener resultado final
-        with self._counter_lock:
-            indexed_fragments = self._indexed_fragments_count
+        # Enviar los fragmentos que quedaron en el último lote
+        self._flush_weaviate_batch()
+        self._notify_project_data_changed(project_name)
+
+        # Obtener resultado final (descontando los objetos rechazados por Weaviate)
+        indexed_fragments = self._indexed_fragments_count - len(self._batch_errors)
+        errors.extend(self._batch_errors)
             
         total_time = int(time.time() - start_time)
         min_total, sec_total = divmod(total_time, 60)
@@ -1170,22 +2033,26 @@ Responde solo con la descripción, sin explicaciones adicionales."""
             "vue": [".vue"]
         }
         
+        # Índice inverso extensión -> tecnología para no recorrer tech_indicators por archivo
+        tech_by_ext = {ext: tech for tech, extensions in tech_indicators.items() for ext in extensions}
+
         detected_techs = set()
-        
+        total_files = 0
+
         for root, dirs, files in os.walk(project_path):
             # Ignorar directorios irrelevantes
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ['node_modules', 'dist', 'build']]
-            
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ('node_modules', 'dist', 'build')]
+
             for file in files:
                 if not file.startswith('.'):
-                    structure["total_files"] += 1
-                    
+                    total_files += 1
+
                     # Detectar tecnología por extensión
-                    file_ext = os.path.splitext(file)[1].lower()
-                    for tech, extensions in tech_indicators.items():
-                        if file_ext in extensions:
-                            detected_techs.add(tech)
-        
+                    tech = tech_by_ext.get(os.path.splitext(file)[1].lower())
+                    if tech:
+                        detected_techs.add(tech)
+
+        structure["total_files"] = total_files
         structure["technologies_detected"] = list(detected_techs)
         
         # Detectar patrones arquitectónicos básicos
@@ -1201,17 +2068,37 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         
         return structure
 
-    def _consultar_ollama(self, prompt: str) -> str:
-        """Consulta a Ollama para generar descripciones"""
+    def _consultar_ollama(self, prompt: str, options: Optional[Dict] = None) -> str:
+        """
+        Consulta a Ollama para generar descripciones (un prompt ya respondido sale de la caché).
+        options se pasa tal cual a /api/generate (num_predict, stop, ...) para no generar tokens que se descartan.
+        """
+        model = "llama3:instruct"
+        options_key = json.dumps(options, sort_keys=True) if options else ""
+        cache_key = hashlib.blake2b(f"{model}\0{options_key}\0{prompt}".encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        with self._generation_cache_lock:
+            cached = self._generation_cache.get(cache_key)
+            if cached is not None:
+                self._generation_cache.move_to_end(cache_key)
+                return cached
+        
         payload = {
-            "model": "llama3:instruct",
+            "model": model,
             "prompt": prompt,
             "stream": False
         }
+        if options:
+            payload["options"] = options
         try:
-            response = requests.post(f"{self.ollama_url}/api/generate", json=payload)
+            response = self._http.post(f"{self.ollama_url}/api/generate", data=_json_dumps(payload), headers=_JSON_HEADERS)
             if response.status_code == 200:
-                return response.json().get("response", "").strip()
+                text = _json_loads(response.content).get("response", "").strip()
+                # Solo se guardan respuestas válidas; los errores se reintentan en la próxima consulta
+                with self._generation_cache_lock:
+                    self._generation_cache[cache_key] = text
+                    while len(self._generation_cache) > max(0, self.generation_cache_size or 0):
+                        self._generation_cache.popitem(last=False)
+                return text
             else:
                 return f"[Error {response.status_code} al consultar Ollama]"
         except Exception as e:
@@ -1280,52 +2167,53 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         class_name = f"CodeFragments_{self._sanitize_project_name(project_name)}"
         
         try:
-            # Obtener todos los fragmentos
-            result = (
-                self.weaviate_client.query
-                .get(class_name, [
-                    'fileName', 'filePath', 'type', 'functionName', 'module', 
-                    'language', 'complexity', 'startLine', 'endLine'
-                ])
-                .with_limit(1000)  # Límite alto para obtener todos
-                .do()
-            )
-            
-            if 'data' in result and 'Get' in result['data'] and class_name in result['data']['Get']:
-                fragments = result['data']['Get'][class_name]
-                
-                # Agrupar por tipo
-                modules_by_type = {}
-                for fragment in fragments:
-                    ftype = fragment.get('type', 'unknown')
-                    if ftype not in modules_by_type:
-                        modules_by_type[ftype] = []
-                    modules_by_type[ftype].append(fragment)
-                
-                # Estadísticas
-                total_fragments = len(fragments)
-                languages = set(f.get('language', 'unknown') for f in fragments)
-                modules = set(f.get('module', 'unknown') for f in fragments)
+            # Obtener todos los fragmentos, por páginas con cursor (with_after) para no
+            # quedarse en las primeras LIST_PAGE_SIZE de proyectos grandes
+            fragments = []
+            after = None
+            while True:
+                query = (
+                    self.weaviate_client.query
+                    .get(class_name, [
+                        'fileName', 'filePath', 'type', 'functionName', 'module', 
+                        'language', 'complexity', 'startLine', 'endLine'
+                    ])
+                    .with_additional(['id'])
+                    .with_limit(LIST_PAGE_SIZE)
+                )
+                if after:
+                    query = query.with_after(after)
+                result = query.do()
                 
-                return {
-                    "success": True,
-                    "project_name": project_name,
-                    "total_fragments": total_fragments,
-                    "modules_by_type": modules_by_type,
-                    "languages": list(languages),
-                    "modules": list(modules),
-                    "all_modules": fragments  # Para compatibilidad
-                }
-            else:
-                return {
-                    "success": True,
-                    "project_name": project_name,
-                    "total_fragments": 0,
-                    "modules_by_type": {},
-                    "languages": [],
-                    "modules": [],
-                    "all_modules": []
-                }
+                page = ((result.get('data') or {}).get('Get') or {}).get(class_name) or []
+                for fragment in page:
+                    after = (fragment.pop('_additional', None) or {}).get('id')
+                fragments.extend(page)
+                if len(page) < LIST_PAGE_SIZE or not after:
+                    break
+            
+            # Agrupar por tipo
+            modules_by_type = {}
+            for fragment in fragments:
+                ftype = fragment.get('type', 'unknown')
+                if ftype not in modules_by_type:
+                    modules_by_type[ftype] = []
+                modules_by_type[ftype].append(fragment)
+            
+            # Estadísticas
+            total_fragments = len(fragments)
+            languages = set(f.get('language', 'unknown') for f in fragments)
+            modules = set(f.get('module', 'unknown') for f in fragments)
+            
+            return {
+                "success": True,
+                "project_name": project_name,
+                "total_fragments": total_fragments,
+                "modules_by_type": modules_by_type,
+                "languages": list(languages),
+                "modules": list(modules),
+                "all_modules": fragments  # Para compatibilidad
+            }
                 
         except Exception as e:
             return {"error": f"Error listando módulos: {e}"}
@@ -1335,30 +2223,32 @@ Responde solo con la descripción, sin explicaciones adicionales."""
         if not fragments:
             return "No se encontraron fragmentos relevantes."
         
-        context = f"=== FRAGMENTOS RELEVANTES PARA: '{query}' ===\n\n"
+        parts = [f"=== FRAGMENTOS RELEVANTES PARA: '{query}' ===\n\n"]
         
         for i, fragment in enumerate(fragments[:10], 1):  # Limitar a 10 para no saturar
-            context += f"FRAGMENTO {i}:\n"
-            context += f"  📁 Archivo: {fragment.get('fileName', 'N/A')}\n"
-            context += f"  📍 Ubicación: {fragment.get('filePath', 'N/A')} (líneas {fragment.get('startLine', 'N/A')}-{fragment.get('endLine', 'N/A')})\n"
-            context += f"  🏷️  Tipo: {fragment.get('type', 'N/A')}\n"
-            context += f"  🔧 Función/Clase: {fragment.get('functionName', 'N/A')}\n"
-            context += f"  📦 Módulo: {fragment.get('module', 'N/A')}\n"
-            context += f"  💻 Lenguaje: {fragment.get('language', 'N/A')}\n"
-            context += f"  📊 Complejidad: {fragment.get('complexity', 'N/A')}\n"
-            context += f"  📝 Descripción: {fragment.get('description', 'N/A')}\n"
-            
             # Mostrar contenido truncado
             content = fragment.get('content', '')
             if len(content) > 300:
                 content = content[:300] + "..."
-            context += f"  💾 Contenido:\n{content}\n"
-            context += f"  {'-' * 50}\n\n"
+            
+            parts.append(
+                f"FRAGMENTO {i}:\n"
+                f"  📁 Archivo: {fragment.get('fileName', 'N/A')}\n"
+                f"  📍 Ubicación: {fragment.get('filePath', 'N/A')} (líneas {fragment.get('startLine', 'N/A')}-{fragment.get('endLine', 'N/A')})\n"
+                f"  🏷️  Tipo: {fragment.get('type', 'N/A')}\n"
+                f"  🔧 Función/Clase: {fragment.get('functionName', 'N/A')}\n"
+                f"  📦 Módulo: {fragment.get('module', 'N/A')}\n"
+                f"  💻 Lenguaje: {fragment.get('language', 'N/A')}\n"
+                f"  📊 Complejidad: {fragment.get('complexity', 'N/A')}\n"
+                f"  📝 Descripción: {fragment.get('description', 'N/A')}\n"
+                f"  💾 Contenido:\n{content}\n"
+                f"  {'-' * 50}\n\n"
+            )
         
         if len(fragments) > 10:
-            context += f"... y {len(fragments) - 10} fragmentos más.\n"
+            parts.append(f"... y {len(fragments) - 10} fragmentos más.\n")
         
-        return context
+        return ''.join(parts)
 
     def _generate_ai_response(self, query: str, context: str) -> str:
         """Genera respuesta usando IA basada en el contexto de fragmentos"""
@@ -1383,7 +2273,7 @@ RESPUESTA:"""
         return self._consultar_ollama(prompt)
 
     def delete_project_data(self, project_name: str) -> bool:
-        """Elimina datos del proyecto"""
+        """Elimina datos del proyecto (la clase completa, sin dejarla vacía en el esquema)"""
         if not self.weaviate_client:
             return False
         
@@ -1391,6 +2281,7 @@ RESPUESTA:"""
         
         try:
             self.weaviate_client.schema.delete_class(class_name)
+            self._notify_project_data_changed(project_name)
             print(f"✅ Fragmentos del proyecto '{project_name}' eliminados de Weaviate")
             return True
         except Exception as e:
@@ -1,14 +1,30 @@
 import os
+import re
 import json
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, List, Optional, Tuple
 from enum import Enum
 import time
+import hashlib
+import threading
+from collections import OrderedDict
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+try:
+    import httpx  # Opcional: cliente HTTP/2 para las APIs cloud (pip install "httpx[http2]")
+except ImportError:
+    httpx = None
+
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+# Palabras clave que ajustan la estimación de contexto (_estimate_context_size)
+_CODE_CONTEXT_KEYWORDS = ("código", "code", "función", "class", "import", "fragmentos")
+_LARGE_PROJECT_KEYWORDS = ("proyecto completo", "migración masiva", "300k líneas")
+
 class TaskType(Enum):
     """Tipos de tareas para el enrutamiento de modelos"""
     MIGRACION_COMPLEJA = "migracion_compleja"
@@ -29,6 +45,51 @@ class ModelProvider(Enum):
     GEMINI = "gemini"
     PERPLEXITY = "perplexity"
 
+# Palabras clave por tipo de tarea, en orden de prioridad (_detect_task_type)
+_TASK_KEYWORDS = {
+    TaskType.MIGRACION_COMPLEJA: (
+        "migra el proyecto", "migrar proyecto", "convertir proyecto",
+        "300k líneas", "proyecto completo", "migración masiva"
+    ),
+    TaskType.MIGRACION_SENCILLA: (
+        "migra este archivo", "convertir archivo", "cambiar de",
+        "refactorizar", "actualizar código"
+    ),
+    TaskType.ANALISIS_CODIGO: (
+        "analiza el proyecto", "analizar código", "estructura del proyecto",
+        "dependencias", "patrones", "arquitectura", "fragmentos",
+        "funciones", "clases", "componentes", "módulos", "que hace",
+        "cómo funciona", "explicar código", "revisar código"
+    ),
+    TaskType.CONVERSACION_JUEGO: (
+        "puntaje", "nivel", "juego", "personaje", "historia",
+        "aventura", "quest", "misión"
+    ),
+    TaskType.DEBUGGING: (
+        "error", "bug", "problema", "no funciona", "falla",
+        "excepción", "debug", "arreglar", "solucionar"
+    ),
+    TaskType.DOCUMENTACION: (
+        "documenta", "explicar", "cómo funciona", "tutorial",
+        "guía", "readme", "comentarios", "documentación"
+    ),
+    TaskType.ARQUITECTURA: (
+        "diseño", "arquitectura", "patrones", "estructura",
+        "escalabilidad", "performance", "organización"
+    ),
+    TaskType.CONSULTA_SIMPLE: (
+        "qué es", "cuál es", "dónde está", "cuándo", "por qué",
+        "buscar", "encontrar", "mostrar", "listar"
+    )
+}
+
+# Límites (tokens) de las categorías de tamaño de contexto (_categorize_context_size)
+_CONTEXT_SIZE_LIMITS = (500, 2000, 10000, 30000)
+_CONTEXT_SIZE_CATEGORIES = ("muy_pequeño", "pequeño", "mediano", "grande", "muy_grande")
+
+# Inicio de la respuesta a cada ítem en batch_query: "[n]" al comienzo de una línea
+_BATCH_ITEM_RE = re.compile(r'^[ \t]*\[(\d+)\][ \t:.-]*', re.MULTILINE)
+
 class ModelRouterAgent:
     """
     Meta-agente que orquesta múltiples LLMs y decide dinámicamente
@@ -36,6 +97,10 @@ class ModelRouterAgent:
     """
     
     def __init__(self):
+        # Cliente HTTP compartido por todos los proveedores: reutiliza conexiones keep-alive
+        # (sin repetir DNS + TCP + TLS en cada consulta a las APIs cloud)
+        self._http = self._create_http_client()
+
         # Configuración de modelos con límites de contexto reales
         self.model_config = {
             ModelProvider.OLLAMA: {
@@ -146,12 +211,51 @@ class ModelRouterAgent:
             "by_task_type": {},
             "by_context_size": {},
             "fallbacks": 0,
-            "errors": 0
+            "errors": 0,
+            "cache_hits": 0,
+            "cache_misses": 0
         }
+        # Las consultas en paralelo (batch_route_and_query) comparten estas estadísticas
+        self._stats_lock = threading.Lock()
+
+        # Respuestas recientes por (proveedor, prompt, max_tokens, temperature): LRU con caducidad.
+        # Por defecto solo se reutilizan consultas casi deterministas (temperature <= response_cache_max_temperature):
+        # con los valores por defecto solo query_code_analysis y batch_query; use_cache=True lo fuerza
+        self.response_cache_size = 256
+        self.response_cache_ttl = 300  # segundos
+        self.response_cache_max_temperature = 0.3
+        self._response_cache = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+
+        # Disponibilidad por proveedor: (disponible, instante de la comprobación), válida availability_ttl segundos.
+        # Evita repetir el sondeo a Ollama (hasta 2 s si no responde) en cada búsqueda de fallbacks
+        self.availability_ttl = 30
+        self._availability_cache = {}
+        self._availability_lock = threading.Lock()
 
         # Filtrar solo proveedores disponibles al inicializar (después de definir routing_rules)
         self._filter_available_providers()
 
+    def _create_http_client(self):
+        """
+        httpx con HTTP/2 si está instalado (las consultas en paralelo comparten una conexión
+        por API cloud); si no, una sesión de requests con pool de conexiones.
+        Ambos exponen get/post(url, headers=, json=, timeout=) y close(), y se comportan igual:
+        mismo timeout por llamada, redirecciones seguidas, sin reintentos (los errores de
+        conexión, httpx.HTTPError o requests.RequestException, los captura quien llama).
+        """
+        if httpx is not None:
+            try:
+                return httpx.Client(http2=True, timeout=60, follow_redirects=True,
+                                    limits=httpx.Limits(max_connections=32, max_keepalive_connections=32))
+            except ImportError:
+                pass  # httpx sin el extra http2 (paquete h2): se usa requests
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
     def _filter_available_providers(self):
         """
         Filtra las reglas de enrutamiento para incluir solo proveedores disponibles
@@ -220,12 +324,17 @@ class ModelRouterAgent:
         if len(available_providers) == 1 and ModelProvider.OLLAMA in available_providers:
             print("💡 Solo Ollama disponible - perfecto para indexación, considera agregar API keys para análisis avanzado")
 
-    def route_and_query(self, prompt: str, task_type: Optional[TaskType] = None, mode: str = "default", context_size: int = 0, max_tokens: int = 1024, temperature: float = 0.7) -> Dict:
+    def route_and_query(self, prompt: str, task_type: Optional[TaskType] = None, mode: str = "default", context_size: int = 0, max_tokens: int = 1024, temperature: float = 0.7,
+                        use_cache: Optional[bool] = None) -> Dict:
         """
         Enruta inteligentemente la consulta al mejor proveedor disponible según la tarea, contexto y disponibilidad.
+        use_cache: None usa la caché de respuestas solo si temperature <= response_cache_max_temperature
+        (no con la temperatura por defecto, 0.7); True la usa siempre (la clave incluye la temperatura,
+        así que se repite la misma respuesta muestreada) y False nunca.
         """
         # Actualizar estadísticas totales
-        self.usage_stats["total_requests"] += 1
+        with self._stats_lock:
+            self.usage_stats["total_requests"] += 1
         
         try:
             # 1. DETECTAR TIPO DE TAREA SI NO SE ESPECIFICA
@@ -239,6 +348,19 @@ class ModelRouterAgent:
             # 3. SELECCIONAR MEJOR PROVEEDOR
             selected_provider = self._select_best_provider(task_type, prompt, context_size)
             
+            # Consulta idéntica reciente: se responde desde la caché sin llamar al proveedor
+            cache_key = None
+            if use_cache is None:
+                use_cache = temperature <= self.response_cache_max_temperature
+            if self.response_cache_size and use_cache:
+                cache_key = self._response_cache_key(selected_provider, prompt, max_tokens, temperature)
+                cached = self._cached_response(cache_key)
+                with self._stats_lock:
+                    self.usage_stats["cache_hits" if cached is not None else "cache_misses"] += 1
+                if cached is not None:
+                    cached["cached"] = True
+                    return cached
+            
             # 4. EJECUTAR CON SISTEMA DE FALLBACK
             result = self._execute_with_fallback(
                 provider=selected_provider,
@@ -250,7 +372,8 @@ class ModelRouterAgent:
             )
             
             # 5. ACTUALIZAR ESTADÍSTICAS
-            self._update_stats(selected_provider, task_type, result["success"], context_size)
+            with self._stats_lock:
+                self._update_stats(selected_provider, task_type, result["success"], context_size)
             
             # 6. AGREGAR METADATA AL RESULTADO
             result.update({
@@ -259,11 +382,15 @@ class ModelRouterAgent:
                 "selected_provider": selected_provider.value
             })
             
+            if cache_key is not None and result["success"]:
+                self._store_response(cache_key, result)
+            
             return result
             
         except Exception as e:
             # Error en el enrutamiento
-            self.usage_stats["errors"] += 1
+            with self._stats_lock:
+                self.usage_stats["errors"] += 1
             return {
                 "success": False,
                 "error": f"Error en enrutamiento: {str(e)}",
@@ -272,18 +399,112 @@ class ModelRouterAgent:
                 "context_size": context_size
             }
 
+    def _response_cache_key(self, provider: ModelProvider, prompt: str, max_tokens: int, temperature: float) -> bytes:
+        """Clave de la caché de respuestas: hash de 16 bytes del proveedor, parámetros y prompt"""
+        raw = f"{provider.value}\0{max_tokens}\0{temperature}\0{prompt}"
+        return hashlib.blake2b(raw.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+    def _cached_response(self, key: bytes) -> Optional[Dict]:
+        """Copia de la respuesta guardada para la clave (None si no está o ya caducó)"""
+        with self._response_cache_lock:
+            entry = self._response_cache.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if time.monotonic() - stored_at > self.response_cache_ttl:
+                del self._response_cache[key]
+                return None
+            self._response_cache.move_to_end(key)
+            return dict(result)
+
+    def _store_response(self, key: bytes, result: Dict):
+        """Guarda una respuesta exitosa descartando las menos usadas al superar response_cache_size"""
+        with self._response_cache_lock:
+            self._response_cache[key] = (time.monotonic(), dict(result))
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > self.response_cache_size:
+                self._response_cache.popitem(last=False)
+
+    def clear_cache(self):
+        """Vacía la caché de respuestas"""
+        with self._response_cache_lock:
+            self._response_cache.clear()
+
+    def batch_route_and_query(self, prompts: List[str], max_workers: int = 4, **kwargs) -> List[Dict]:
+        """
+        Enruta varias consultas en paralelo (threads sobre la sesión HTTP compartida).
+        Devuelve los resultados en el mismo orden que los prompts; kwargs se pasan a route_and_query.
+        """
+        if not prompts:
+            return []
+        if len(prompts) == 1 or max_workers <= 1:
+            return [self.route_and_query(prompt, **kwargs) for prompt in prompts]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as executor:
+            return list(executor.map(lambda prompt: self.route_and_query(prompt, **kwargs), prompts))
+
+    def batch_query(self, prompts: List[str], task_type: Optional[TaskType] = None,
+                    max_tokens_per_item: int = 256, temperature: float = 0.3,
+                    batch_size: int = 8, max_batch_tokens: int = 4096) -> List[Dict]:
+        """
+        Resuelve varios prompts cortos empaquetando hasta batch_size en una sola consulta
+        (sin superar max_batch_tokens estimados por consulta). Devuelve un resultado por prompt,
+        en el mismo orden; los ítems que no vengan en la respuesta se consultan por separado.
+        """
+        results = []
+        for group in self._group_batch_prompts(prompts, batch_size, max_batch_tokens):
+            if len(group) == 1:
+                results.append(self.route_and_query(group[0], task_type=task_type,
+                                                    max_tokens=max_tokens_per_item, temperature=temperature))
+                continue
+            
+            items = "\n\n".join(f"[{number}] {prompt}" for number, prompt in enumerate(group, 1))
+            batch_prompt = f"""Responde por separado a cada uno de estos {len(group)} ítems:
+
+{items}
+
+Empieza la respuesta a cada ítem en una línea nueva con "[número]", en el mismo orden y sin texto adicional."""
+            result = self.route_and_query(batch_prompt, task_type=task_type,
+                                          max_tokens=max_tokens_per_item * len(group), temperature=temperature)
+            answers = self._split_batch_response(result["response"]) if result.get("success") else {}
+            
+            for number, prompt in enumerate(group, 1):
+                answer = answers.get(number)
+                if answer:
+                    results.append(dict(result, response=answer, batch_size=len(group)))
+                else:
+                    # El ítem no vino en la respuesta (o la consulta falló): se consulta por separado
+                    results.append(self.route_and_query(prompt, task_type=task_type,
+                                                        max_tokens=max_tokens_per_item, temperature=temperature))
+        return results
+
+    def _group_batch_prompts(self, prompts: List[str], batch_size: int, max_batch_tokens: int) -> List[List[str]]:
+        """Agrupa prompts consecutivos respetando el número de ítems y los tokens estimados por consulta"""
+        groups, group, group_tokens = [], [], 0
+        for prompt in prompts:
+            tokens = len(prompt) // 4
+            if group and (len(group) >= batch_size or group_tokens + tokens > max_batch_tokens):
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(prompt)
+            group_tokens += tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    def _split_batch_response(self, response: str) -> Dict[int, str]:
+        """Separa la respuesta empaquetada en {número de ítem: respuesta}"""
+        answers = {}
+        matches = list(_BATCH_ITEM_RE.finditer(response))
+        for i, match in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(response)
+            answer = response[match.end():end].strip()
+            if answer:
+                answers.setdefault(int(match.group(1)), answer)
+        return answers
+
     def _categorize_context_size(self, context_size: int) -> str:
         """Categoriza el tamaño del contexto"""
-        if context_size < 500:
-            return "muy_pequeño"
-        elif context_size < 2000:
-            return "pequeño"
-        elif context_size < 10000:
-            return "mediano"
-        elif context_size < 30000:
-            return "grande"
-        else:
-            return "muy_grande"
+        return _CONTEXT_SIZE_CATEGORIES[bisect_right(_CONTEXT_SIZE_LIMITS, context_size)]
 
     def _detect_task_type(self, prompt: str, mode: str) -> TaskType:
         """
@@ -291,46 +512,8 @@ class ModelRouterAgent:
         """
         prompt_lower = prompt.lower()
         
-        # Palabras clave para cada tipo de tarea
-        keywords = {
-            TaskType.MIGRACION_COMPLEJA: [
-                "migra el proyecto", "migrar proyecto", "convertir proyecto",
-                "300k líneas", "proyecto completo", "migración masiva"
-            ],
-            TaskType.MIGRACION_SENCILLA: [
-                "migra este archivo", "convertir archivo", "cambiar de",
-                "refactorizar", "actualizar código"
-            ],
-            TaskType.ANALISIS_CODIGO: [
-                "analiza el proyecto", "analizar código", "estructura del proyecto",
-                "dependencias", "patrones", "arquitectura", "fragmentos",
-                "funciones", "clases", "componentes", "módulos", "que hace",
-                "cómo funciona", "explicar código", "revisar código"
-            ],
-            TaskType.CONVERSACION_JUEGO: [
-                "puntaje", "nivel", "juego", "personaje", "historia",
-                "aventura", "quest", "misión"
-            ],
-            TaskType.DEBUGGING: [
-                "error", "bug", "problema", "no funciona", "falla",
-                "excepción", "debug", "arreglar", "solucionar"
-            ],
-            TaskType.DOCUMENTACION: [
-                "documenta", "explicar", "cómo funciona", "tutorial",
-                "guía", "readme", "comentarios", "documentación"
-            ],
-            TaskType.ARQUITECTURA: [
-                "diseño", "arquitectura", "patrones", "estructura",
-                "escalabilidad", "performance", "organización"
-            ],
-            TaskType.CONSULTA_SIMPLE: [
-                "qué es", "cuál es", "dónde está", "cuándo", "por qué",
-                "buscar", "encontrar", "mostrar", "listar"
-            ]
-        }
-        
         # Detectar por palabras clave
-        for task_type, words in keywords.items():
+        for task_type, words in _TASK_KEYWORDS.items():
             if any(word in prompt_lower for word in words):
                 return task_type
         
@@ -350,13 +533,15 @@ class ModelRouterAgent:
         """
         # Estimación básica: 4 caracteres por token
         estimated_tokens = len(prompt) // 4
+        # Un solo lower() para todas las búsquedas (el prompt incluye el contexto completo)
+        prompt_lower = prompt.lower()
         
         # Ajustes por tipo de contenido
-        if any(keyword in prompt.lower() for keyword in ["código", "code", "función", "class", "import", "fragmentos"]):
+        if any(keyword in prompt_lower for keyword in _CODE_CONTEXT_KEYWORDS):
             # El código tiende a tener más tokens por carácter
             estimated_tokens = int(estimated_tokens * 1.2)
         
-        if any(keyword in prompt.lower() for keyword in ["proyecto completo", "migración masiva", "300k líneas"]):
+        if any(keyword in prompt_lower for keyword in _LARGE_PROJECT_KEYWORDS):
             # Proyectos grandes probablemente necesitarán mucho contexto
             estimated_tokens = max(estimated_tokens, 50000)
         
@@ -447,8 +632,8 @@ class ModelRouterAgent:
         """
         Aplica lógica específica de tarea entre proveedores disponibles
         """
-        prompt_lower = prompt.lower()
-        is_complex = len(prompt) > 1000 or "complejo" in prompt_lower
+        # lower() solo hace falta (y solo se paga) para prompts cortos
+        is_complex = len(prompt) > 1000 or "complejo" in prompt.lower()
         
         # Para tareas complejas, preferir modelos cloud
         if is_complex and task_type in [TaskType.MIGRACION_COMPLEJA, TaskType.ARQUITECTURA]:
@@ -476,14 +661,28 @@ class ModelRouterAgent:
 
     def _is_provider_available(self, provider: ModelProvider) -> bool:
         """
-        Verifica si un proveedor está disponible
+        Verifica si un proveedor está disponible (reutiliza la comprobación de los últimos availability_ttl segundos)
+        """
+        with self._availability_lock:
+            cached = self._availability_cache.get(provider)
+        if cached is not None and time.monotonic() - cached[1] < self.availability_ttl:
+            return cached[0]
+        
+        available = self._check_provider_available(provider)
+        with self._availability_lock:
+            self._availability_cache[provider] = (available, time.monotonic())
+        return available
+
+    def _check_provider_available(self, provider: ModelProvider) -> bool:
+        """
+        Comprueba en el momento si un proveedor está disponible
         """
         config = self.model_config[provider]
         
         if provider == ModelProvider.OLLAMA:
             # Verificar si Ollama está corriendo
             try:
-                response = requests.get(f"{config['url']}/api/tags", timeout=2)
+                response = self._http.get(f"{config['url']}/api/tags", timeout=2)
                 return response.status_code == 200
             except:
                 return False
@@ -511,7 +710,8 @@ class ModelRouterAgent:
             return result
         
         # Si falla, intentar fallbacks (solo de la lista ya filtrada)
-        self.usage_stats["fallbacks"] += 1
+        with self._stats_lock:
+            self.usage_stats["fallbacks"] += 1
         fallback_providers = self.routing_rules.get(task_type, [])
         
         for fallback_provider in fallback_providers:
@@ -534,7 +734,8 @@ class ModelRouterAgent:
                     return result
         
         # Si todo falla
-        self.usage_stats["errors"] += 1
+        with self._stats_lock:
+            self.usage_stats["errors"] += 1
         return {
             "success": False,
             "response": "❌ Error: No se pudo conectar con ningún modelo disponible. Verifica tu configuración.",
@@ -580,7 +781,7 @@ class ModelRouterAgent:
             }
         }
         
-        response = requests.post(f"{config['url']}/api/generate", json=payload, timeout=60)
+        response = self._http.post(f"{config['url']}/api/generate", json=payload, timeout=60)
         
         if response.status_code == 200:
             result = response.json()
@@ -613,7 +814,7 @@ class ModelRouterAgent:
             "messages": [{"role": "user", "content": prompt}]
         }
         
-        response = requests.post(config["url"], headers=headers, json=payload, timeout=60)
+        response = self._http.post(config["url"], headers=headers, json=payload, timeout=60)
         
         if response.status_code == 200:
             result = response.json()
@@ -645,7 +846,7 @@ class ModelRouterAgent:
             "temperature": temperature
         }
         
-        response = requests.post(config["url"], headers=headers, json=payload, timeout=60)
+        response = self._http.post(config["url"], headers=headers, json=payload, timeout=60)
         
         if response.status_code == 200:
             result = response.json()
@@ -675,7 +876,7 @@ class ModelRouterAgent:
             }
         }
         
-        response = requests.post(url, json=payload, timeout=60)
+        response = self._http.post(url, json=payload, timeout=60)
         
         if response.status_code == 200:
             result = response.json()
@@ -707,7 +908,7 @@ class ModelRouterAgent:
             "temperature": temperature
         }
         
-        response = requests.post(config["url"], headers=headers, json=payload, timeout=60)
+        response = self._http.post(config["url"], headers=headers, json=payload, timeout=60)
         
         if response.status_code == 200:
             result = response.json()
@@ -760,6 +961,10 @@ class ModelRouterAgent:
             context_stats["providers"][provider_name] = 0
         context_stats["providers"][provider_name] += 1
 
+    def close(self):
+        """Cierra el cliente HTTP compartido con los proveedores"""
+        self._http.close()
+
     def get_stats(self) -> Dict:
         """Obtiene estadísticas de uso"""
         return self.usage_stats
@@ -45,7 +45,8 @@ def detect_optimal_config():
         "aggressive_workers": min(32, recommended_workers + 4)
     }
 
-def setup_agent(max_workers=None, ollama_max_concurrent=2, file_timeout=60, ollama_timeout=30):
+def setup_agent(max_workers=None, ollama_max_concurrent=2, file_timeout=60, ollama_timeout=30,
+                batch_size=None, batch_workers=None, vector_compression=None):
     """Inicializa el agente de análisis con configuración personalizable"""
     try:
         print(f"🔧 Inicializando agente con max_workers={max_workers}, ollama_max_concurrent={ollama_max_concurrent}")
@@ -55,7 +56,10 @@ def setup_agent(max_workers=None, ollama_max_concurrent=2, file_timeout=60, olla
             max_workers=max_workers,
             ollama_max_concurrent=ollama_max_concurrent,
             file_timeout=file_timeout,
-            ollama_timeout=ollama_timeout
+            ollama_timeout=ollama_timeout,
+            batch_size=batch_size or 100,
+            batch_workers=batch_workers,
+            vector_compression=vector_compression
         )
         return agent
     except Exception as e:
@@ -71,7 +75,10 @@ def cmd_analizar(args):
         max_workers=getattr(args, 'workers', None),
         ollama_max_concurrent=getattr(args, 'ollama_concurrent', 2),
         file_timeout=getattr(args, 'file_timeout', 60),
-        ollama_timeout=getattr(args, 'ollama_timeout', 30)
+        ollama_timeout=getattr(args, 'ollama_timeout', 30),
+        batch_size=getattr(args, 'batch_size', None),
+        batch_workers=getattr(args, 'batch_workers', None),
+        vector_compression=getattr(args, 'vector_compression', None)
     )
     if not agent:
         return
@@ -305,6 +312,9 @@ Ejemplos de uso:
   # Analizar con timeouts personalizados
   python analizador_codigo.py analizar C:/MisProyectos/MiApp --name MiApp --file_timeout 120 --ollama_timeout 60
 
+  # Analizar con lotes más grandes hacia Weaviate
+  python analizador_codigo.py analizar C:/MisProyectos/MiApp --name MiApp --batch_size 200 --batch_workers 2
+
   # Analizar con logs detallados
   python analizador_codigo.py analizar C:/MisProyectos/MiApp --name MiApp --verbose
 
@@ -331,8 +341,11 @@ Configuración recomendada:
     parser_analizar.add_argument('--logfile', action='store_true', help='Generar archivos de log en directorio "logs" (borra logs anteriores)')
     parser_analizar.add_argument('--workers', type=int, help='Número máximo de trabajadores')
     parser_analizar.add_argument('--ollama_concurrent', type=int, help='Número máximo de conexiones concurrentes con Ollama')
-    parser_analizar.add_argument('--file_timeout', type=int, help='Tiempo de espera para archivos')
+    parser_analizar.add_argument('--file_timeout', type=int, default=60, help='Segundos máximos de extracción por archivo (default: 60)')
     parser_analizar.add_argument('--ollama_timeout', type=int, help='Tiempo de espera para Ollama')
+    parser_analizar.add_argument('--batch_size', type=int, help='Fragmentos por lote enviado a Weaviate (default: 100)')
+    parser_analizar.add_argument('--batch_workers', type=int, help='Lotes enviados a Weaviate en paralelo (default: 1)')
+    parser_analizar.add_argument('--vector_compression', choices=['pq', 'bq'], help='Comprime los vectores en el índice de Weaviate (PQ o BQ; default: sin compresión)')
     parser_analizar.set_defaults(func=cmd_analizar)
     
     # Comando: consultar